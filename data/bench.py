@@ -0,0 +1,179 @@
+"""Benchmarks the data scripts against synthetic inputs.
+
+Generates (or reuses) a synthetic tree per scale with `synth.py`, runs
+each script against it, and records wall time, CPU time, peak RSS and
+rows/sec for each, along with the per-stage breakdown from the scripts'
+own profiling reports. Results are appended to `{out}/results.json`
+and compared against the previous run of the same script and scale:
+
+    python bench.py --scales 1000,10000
+    python bench.py --scales 1000 --only process_data.ZCTA --jobs 4
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import subprocess
+from glob import glob
+from datetime import datetime
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# In dependency order (process_data.py reads the lookup
+# reverse_geocode.py writes, and process_factsheets.py reads
+# the CD tile data and meta process_data.py writes)
+SCRIPTS = [
+    ('reverse_geocode', ['reverse_geocode.py']),
+    ('check_coords', ['check_coords.py']),
+    ('process_data.ZCTA', ['process_data.py', 'ZCTA', '--force']),
+    ('process_data.CD', ['process_data.py', 'CD', '--force']),
+    ('process_factsheets', ['process_factsheets.py']),
+    ('gen_summary_stat_data', ['gen_summary_stat_data.py']),
+    ('process_numberline', ['process_numberline.py']),
+    ('process_states', ['process_states.py']),
+]
+
+# Caches that would otherwise make repeat runs faster
+CACHES = ['gen/ftfy_cache.json', 'gen/*/shapes.index.json', 'gen/.csv_cache/*']
+
+
+def inputRows(root, name):
+    """Number of input rows a script processes, for rows/sec"""
+    with open(os.path.join(root, 'synth.json')) as f:
+        synth = json.load(f)
+    zone_rows = synth.get('zone_rows', {})
+    if name == 'process_data.ZCTA':
+        return synth['loas'] * synth['years'] * synth['isochrones'] + zone_rows.get('ZCTA', 0)
+    elif name == 'process_data.CD':
+        return synth['cds'] * synth['years'] + zone_rows.get('CD', 0)
+    elif name in ('reverse_geocode', 'check_coords'):
+        return synth['school_rows']
+    elif name == 'process_factsheets':
+        return synth['cds'] + synth['states']
+    elif name in ('process_numberline', 'process_states'):
+        return synth['states']
+    return None
+
+def latestReport(root, name):
+    """The stage breakdown from the script's own profiling report"""
+    reports = sorted(glob(os.path.join(root, 'gen/profile', name, '*.json')))
+    if not reports:
+        return None
+    with open(reports[-1]) as f:
+        return json.load(f)['summary']
+
+def gitCommit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=DATA_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+def generate(root, loas):
+    """Write synthetic data with `synth.py`. Run separately, since a
+    child's peak RSS on Linux starts from the parent's at fork, so
+    loading pandas etc. here would inflate every script's figure"""
+    subprocess.check_call([sys.executable, os.path.join(DATA_DIR, 'synth.py'), root, '--loas', str(loas)])
+
+def runScript(root, name, argv, log):
+    """Run a script in `root`, returning its exit
+    status, wall time, CPU time and peak RSS (MB)"""
+    # Synthetic config.py lives in the root
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join([root, os.environ.get('PYTHONPATH', '')])}
+    start = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, os.path.join(DATA_DIR, argv[0])] + argv[1:],
+                            cwd=root, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    # wait4 gives the resource usage of just this child
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - start
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {
+        'status': proc.returncode,
+        'wall': wall,
+        'cpu': usage.ru_utime + usage.ru_stime,
+        'peak_rss_mb': usage.ru_maxrss * scale / 1e6,
+    }
+
+def compare(result, previous):
+    if previous is None or previous['status'] != 0:
+        return ''
+    return '{:+.0%} time, {:+.0%} RSS'.format(
+        result['wall']/previous['wall'] - 1,
+        result['peak_rss_mb']/previous['peak_rss_mb'] - 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default='1000', help='Comma-separated numbers of ZCTAs to benchmark at')
+    parser.add_argument('--out', default='bench', help='Where to put the synthetic data and results')
+    parser.add_argument('--only', default=None, help='Comma-separated scripts to run, e.g. process_data.ZCTA')
+    parser.add_argument('--jobs', type=int, default=None, help='Passed on to process_data.py')
+    parser.add_argument('--regenerate', action='store_true', help='Regenerate the synthetic data, even if it exists')
+    parser.add_argument('--warm', action='store_true', help="Keep caches from previous runs")
+    args = parser.parse_args()
+
+    only = set(args.only.split(',')) if args.only else None
+    results_path = os.path.join(args.out, 'results.json')
+    try:
+        with open(results_path) as f:
+            history = json.load(f)
+    except FileNotFoundError:
+        history = []
+
+    run = {
+        'started': datetime.now().isoformat(),
+        'commit': gitCommit(),
+        'jobs': args.jobs,
+        'warm': args.warm,
+        'results': [],
+    }
+    for scale in [int(s) for s in args.scales.split(',')]:
+        root = os.path.abspath(os.path.join(args.out, str(scale)))
+        if args.regenerate and os.path.exists(root):
+            shutil.rmtree(root)
+        if not os.path.exists(os.path.join(root, 'synth.json')):
+            print('Generating synthetic data for {} ZCTAs...'.format(scale))
+            generate(root, scale)
+
+        for name, argv in SCRIPTS:
+            if only is not None and name not in only:
+                continue
+            if not args.warm:
+                for pattern in CACHES:
+                    for path in glob(os.path.join(root, pattern)):
+                        os.remove(path)
+            if args.jobs and argv[0] == 'process_data.py':
+                argv = argv + ['--jobs', str(args.jobs)]
+
+            with open(os.path.join(root, '{}.log'.format(name)), 'w') as log:
+                result = runScript(root, name, argv, log)
+            rows = inputRows(root, name)
+            result.update({
+                'script': name,
+                'scale': scale,
+                'rows': rows,
+                'rows_per_sec': rows/result['wall'] if rows else None,
+                'stages': latestReport(root, name) if result['status'] == 0 else None,
+            })
+            run['results'].append(result)
+
+            previous = next((r for prev in reversed(history) for r in prev['results']
+                             if r['script'] == name and r['scale'] == scale), None)
+            if result['status'] != 0:
+                print('{:<24} {:>8} FAILED, see {}/{}.log'.format(name, scale, root, name))
+            else:
+                print('{:<24} {:>8} {:>8.1f}s {:>8.1f}s CPU {:>8.0f}MB {:>10} rows/s  {}'.format(
+                    name, scale, result['wall'], result['cpu'], result['peak_rss_mb'],
+                    '{:.0f}'.format(result['rows_per_sec']) if result['rows_per_sec'] else '-',
+                    compare(result, previous)))
+
+    history.append(run)
+    if not os.path.exists(args.out):
+        os.makedirs(args.out)
+    with open(results_path, 'w') as f:
+        json.dump(history, f, indent=2)
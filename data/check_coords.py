@@ -1,90 +1,114 @@
 import json
-import ftfy
-import fiona
-import requests
-import pandas as pd
+import argparse
 from tqdm import tqdm
 from config import GOOGLE_API_KEY
-from shapely.geometry import shape
+from textfix import fixer
+from profiling import Profiler
+from csvcache import readCSV
+from shapes import ShapeLocator
 from collections import defaultdict
+from geocoding import GEOCODE_URL, GeocodeCache, GeocodeClient, geocode
+from offline_geocoding import Gazetteer
 
-GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+# Which geocoder to use, and address points
+# to add to the gazetteer for the offline one
+try:
+    from config import GEOCODER
+except ImportError:
+    GEOCODER = 'google'
+try:
+    from config import GAZETTEER_ADDRESSES
+except ImportError:
+    GAZETTEER_ADDRESSES = None
 
-all_years = pd.read_csv('src/Master_SchoolList.csv',
+parser = argparse.ArgumentParser()
+parser.add_argument('--geocoder', choices=['google', 'offline'], default=GEOCODER, help='Geocode with the Google API, or offline with the gazetteer')
+parser.add_argument('--addresses', default=GAZETTEER_ADDRESSES, help='CSV of address points for the offline geocoder (LATITUDE, LONGITUDE and address component columns)')
+parser.add_argument('--geocode-url', default=GEOCODE_URL, help='Geocoding endpoint (e.g. a local stub for testing)')
+parser.add_argument('--qps', type=float, default=10, help='Maximum geocoding requests per second')
+parser.add_argument('--workers', type=int, default=8, help='Number of concurrent geocoding requests')
+args = parser.parse_args()
+
+profiler = Profiler('check_coords')
+profiler.start('ingest')
+all_years = readCSV('src/Master_SchoolList.csv',
         encoding='ISO-8859-1',
-        dtype={'YEAR': str, 'ZIP': str})
+        dtype={'YEAR': str, 'ZIP': str},
+        columns=['UNITID', 'ADDR', 'MAPNAME', 'LATITUDE', 'LONGITUD', 'ZIP', 'CITY', 'STABBR'])
 
-try:
-    cached_geocode = json.load(open('gen/cached_geocode.json'))
-except FileNotFoundError:
-    cached_geocode = {}
-
-def geocode(addr):
-    if addr not in cached_geocode:
-        params = {
-            'key': GOOGLE_API_KEY,
-            'address': addr
-        }
-        resp = requests.get(GEOCODE_URL, params=params)
-        data = resp.json()
-        if not data['results']:
-            print('No results for:', addr)
-            return None
-        coords = data['results'][0]['geometry']['location']
-        cached_geocode[addr] = coords
-        with open('gen/cached_geocode.json', 'w') as f:
-            json.dump(cached_geocode, f)
-    return cached_geocode[addr]
+cached_geocode = GeocodeCache('gen/cached_geocode.json')
+client = GeocodeClient(GOOGLE_API_KEY, url=args.geocode_url, qps=args.qps, workers=args.workers)
 
 zip_to_zcta = {}
-for i, row in pd.read_csv('src/zip_to_zcta_2018.csv', dtype={'ZIP_CODE': str, 'ZCTA': str}).iterrows():
+for i, row in readCSV('src/zip_to_zcta_2018.csv', dtype={'ZIP_CODE': str, 'ZCTA': str}, columns=['ZIP_CODE', 'ZCTA']).iterrows():
     zip_to_zcta[row['ZIP_CODE']] = row['ZCTA']
 
-zctas = {}
-for f in tqdm(fiona.open('src/zctas/tl_2017_us_zcta510.shp'), desc='Loading ZCTA shapes'):
-    shp = shape(f['geometry'])
-    zcta = f['properties']['ZCTA5CE10']
-    zctas[zcta] = shp
+profiler.rows(len(all_years))
 
+profiler.start('geometry')
+zctas = ShapeLocator('src/zctas/tl_2017_us_zcta510.shp', 'ZCTA5CE10',
+                     cache_path='gen/ZCTA/shapes.index.json')
+profiler.rows(len(zctas))
+
+# Find the ZCTA actually containing each
+# school coordinate, all at once
+profiler.start('locate')
+coords = all_years[['LATITUDE', 'LONGITUD']].drop_duplicates()
+containing = dict(zip(
+    zip(coords['LATITUDE'], coords['LONGITUD']),
+    zctas.keysFor(coords['LATITUDE'].values, coords['LONGITUD'].values)))
+profiler.rows(len(coords))
+
+profiler.start('check')
 coordinate_corrections = defaultdict(dict)
+coordinate_zctas = defaultdict(list)
+checked = []
 for key, group in tqdm(all_years.groupby(['UNITID', 'ADDR', 'MAPNAME'])):
+    profiler.rows(1)
     unitid, addr, mapname = key
-    schoolkey = '__'.join(ftfy.fix_text(str(v)) if v is not None else 'nan' for v in key)
+    schoolkey = '__'.join(fixer.fix(str(v)) if v is not None else 'nan' for v in key)
     if not isinstance(addr, str):
         continue
     valid = []
     needs_replacing = set()
     for (lat, lng), subgroup in group.groupby(['LATITUDE', 'LONGITUD']):
-        # Check if lat, lng is in the specified zip
-        point = {
-            'type': 'Point',
-            'coordinates': [lng, lat]
-        }
-        point = shape(point)
+        # Check if lat, lng is in the specified zip.
+        # If this zip doesn't have a zcta, just assume
+        # we need to replace it
+        found = containing[(lat, lng)]
         for zip in subgroup['ZIP'].unique():
-            try:
-                zcta = zip_to_zcta[zip.zfill(5)]
-            except KeyError:
-                # If this zip doesn't have a zcta, just assume
-                # we need to replace it
-                needs_replacing.add((lat, lng))
-
-            shp = zctas[zcta]
-            if not shp.contains(point):
-                needs_replacing.add((lat, lng))
-            else:
+            zcta = zip_to_zcta.get(zip.zfill(5))
+            if zcta is not None and found == zcta:
                 valid.append({'lat': lat, 'lng': lng})
+            else:
+                needs_replacing.add((lat, lng))
+                coordinate_zctas[schoolkey].append({
+                    'lat': lat, 'lng': lng, 'zip': zip,
+                    'zcta': zcta, 'found': found})
 
     # Geocode to find suitable coordinates
+    address = None
     if not valid:
         city = group['CITY'].values
         state = group['STABBR'].values
         zip = group['ZIP'].values
         # Last one will be most recent
         address = '{}, {} {} {}'.format(addr, city[-1], state[-1], zip[-1].zfill(5))
-        result = geocode(address)
-        if result is not None:
-            valid.append(result)
+    checked.append((schoolkey, valid, needs_replacing, address))
+
+# Geocode all at once, rather than as each school comes up
+profiler.start('geocode')
+addresses = [address for _, _, _, address in checked if address is not None]
+if args.geocoder == 'offline':
+    geocoded = Gazetteer(addresses=args.addresses).geocode(addresses)
+else:
+    geocoded = geocode(client, cached_geocode, addresses)
+    cached_geocode.compact()
+profiler.rows(len(addresses))
+
+for schoolkey, valid, needs_replacing, address in checked:
+    if address is not None and geocoded[address] is not None:
+        valid.append(geocoded[address])
 
     # Just take first valid coordinates as the one to use
     if valid:
@@ -95,5 +119,15 @@ for key, group in tqdm(all_years.groupby(['UNITID', 'ADDR', 'MAPNAME'])):
     else:
         print('No replacements found for:', schoolkey)
 
+profiler.start('writes')
 with open('gen/coordinate_corrections.json', 'w') as f:
-    json.dump(coordinate_corrections, f)
\ No newline at end of file
+    json.dump(coordinate_corrections, f)
+
+# Coordinates outside their zip's ZCTA, with the ZCTA they're
+# actually in, to suggest corrections without geocoding
+with open('gen/coordinate_zctas.json', 'w') as f:
+    json.dump(coordinate_zctas, f)
+
+fixer.save()
+print(fixer.report())
+profiler.report()
\ No newline at end of file
@@ -0,0 +1,91 @@
+"""Cached CSV loading.
+
+The same large CSVs are parsed (and their dtypes inferred) by several
+scripts, on every run. Instead, each CSV is parsed once into a Feather
+file under `gen/.csv_cache/`, keyed by a hash of the CSV's contents and
+the options it was parsed with, and later reads load just the columns
+they need from that (memory-mapped) file.
+
+Uses pyarrow if it's installed; otherwise CSVs are just read directly.
+"""
+
+import os
+import json
+import warnings
+import numpy as np
+import pandas as pd
+from glob import glob
+from manifest import fingerprint, hashContents
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+CACHE_DIR = 'gen/.csv_cache'
+
+
+def cacheName(path):
+    """Cache files are named for the CSV, and its
+    location in case of CSVs with the same name"""
+    return '{}.{}'.format(os.path.basename(path), fingerprint(os.path.abspath(path))[:8])
+
+def sourceHash(path):
+    """Content hash of the CSV, trusted as long as its size and
+    mtime haven't changed, so unchanged CSVs aren't re-hashed"""
+    st = os.stat(path)
+    stat = [st.st_size, st.st_mtime_ns]
+    sidecar = '{}/{}.hash.json'.format(CACHE_DIR, cacheName(path))
+    try:
+        with open(sidecar) as f:
+            cached = json.load(f)
+        if cached['stat'] == stat:
+            return cached['hash']
+    except FileNotFoundError:
+        pass
+    hash = hashContents(path)
+    with open(sidecar, 'w') as f:
+        json.dump({'stat': stat, 'hash': hash}, f)
+    return hash
+
+def restoreNulls(df):
+    """Feather gives back missing strings as None,
+    where read_csv would have given NaN"""
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].notnull(), np.nan)
+    return df
+
+def readCSV(path, columns=None, dtype=None, encoding=None):
+    """Read a CSV as `pd.read_csv` would, but through the cache.
+    `columns` limits which columns are loaded and
+    `dtype` fixes column types rather than inferring them"""
+    if feather is None:
+        return pd.read_csv(path, usecols=columns, dtype=dtype, encoding=encoding)
+
+    if not os.path.exists(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    name = cacheName(path)
+    src_hash = sourceHash(path)
+    # dtype can also be a single type for all columns
+    dtypes = sorted(dtype.items(), key=lambda kv: kv[0]) if isinstance(dtype, dict) else dtype
+    opts = fingerprint(dtypes or [], encoding)
+    cache_path = '{}/{}.{}.{}.feather'.format(CACHE_DIR, name, src_hash[:16], opts[:8])
+
+    if not os.path.exists(cache_path):
+        df = pd.read_csv(path, dtype=dtype, encoding=encoding)
+        try:
+            # Uncompressed, so it can be memory-mapped
+            feather.write_feather(df, cache_path + '.tmp', compression='uncompressed')
+        except Exception as err:
+            # e.g. columns of mixed types, which Arrow can't store
+            warnings.warn('Not caching {}: {}'.format(path, err))
+            return df[columns] if columns is not None else df
+        os.replace(cache_path + '.tmp', cache_path)
+
+        # Drop caches of older versions of this CSV
+        for old in glob('{}/{}.*.feather'.format(CACHE_DIR, name)):
+            if '.{}.'.format(src_hash[:16]) not in old:
+                os.remove(old)
+
+    df = feather.read_feather(cache_path, columns=columns, memory_map=True)
+    return restoreNulls(df)
@@ -0,0 +1,42 @@
+"""Derive slimmed or augmented tile data from an existing tileset's GeoJSON,
+e.g. `gen/tile_data/CD/ALL.geojson`, one feature at a time, so the source
+never has to be loaded into memory all at once:
+
+    python derive_tileset.py gen/tile_data/CD/ALL.geojson gen/tile_data/CD/Y2019.geojson --years 2019
+"""
+
+import argparse
+from ndjson import NDJSONWriter, iterNDJSON
+
+
+def yearFilter(years):
+    """Keep properties that aren't per-year, or
+    are for one of the given years"""
+    suffixes = tuple('Y:{}'.format(y) for y in years)
+    return lambda key: 'Y:' not in key or key.endswith(suffixes)
+
+def deriveTileset(src, dst, keep=None, transform=None):
+    """Stream features from `src` to `dst`, keeping only the
+    properties `keep` accepts, then applying `transform`
+    (which can add properties) to each feature in place.
+    Returns the number of features written"""
+    with NDJSONWriter(dst) as out:
+        for feat in iterNDJSON(src):
+            if keep is not None:
+                feat['properties'] = {k: v for k, v in feat['properties'].items() if keep(k)}
+            if transform is not None:
+                transform(feat)
+            out.write(feat)
+        return out.count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('src', help='Source tile data (newline-delimited GeoJSON features)')
+    parser.add_argument('dst', help='Where to write the derived tile data')
+    parser.add_argument('--years', default=None, help='Comma-separated years to keep per-year properties for')
+    args = parser.parse_args()
+
+    keep = yearFilter(args.years.split(',')) if args.years else None
+    n = deriveTileset(args.src, args.dst, keep=keep)
+    print('Wrote {} features to {}'.format(n, args.dst))
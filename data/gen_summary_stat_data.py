@@ -1,6 +1,10 @@
 import json
 import pandas as pd
 from glob import glob
+from profiling import Profiler
+from csvcache import readCSV
+
+profiler = Profiler('gen_summary_stat_data')
 
 # Part 2
 isos = ['30min', '45min', '60min']
@@ -29,6 +33,7 @@ cats_map = {
     'all_schools': 'allschools'
 }
 
+profiler.start('summary')
 data = {}
 cats = set()
 years = set()
@@ -37,7 +42,8 @@ for l, fields in levels.items():
     for i in isos:
         data[l][i] = {}
         for f in glob(f'src/summary_stats/{l}/{i}*'):
-            df = pd.read_csv(f)
+            df = readCSV(f)
+            profiler.rows(len(df))
             # Replace NaNs with None for proper JSON
             df = df.where(pd.notnull(df), None)
             df.rename(columns=rename_cols, inplace=True)
@@ -64,6 +70,7 @@ for l, fields in levels.items():
                         for _, row in group.iterrows():
                             data[l][i][y][stat].append([row[k] for k in fields if k in group.columns])
 
+profiler.start('writes')
 for l in levels.keys():
     for i in isos:
         for y in years:
@@ -79,6 +86,7 @@ for l in levels.keys():
 
 
 # Part 3
+profiler.start('school and zip stats')
 school_type_map = {
     'All Schools': 'allschools',
     'Public': 'public',
@@ -89,7 +97,8 @@ school_type_map = {
     'Below Two-Year': 'belowassociate'
 }
 
-sum_school = pd.read_csv('src/summary_stats/sumstats_schools.csv')
+sum_school = readCSV('src/summary_stats/sumstats_schools.csv')
+profiler.rows(len(sum_school))
 for key, sub_df in sum_school.groupby('School Type'):
     school_type = school_type_map[key]
     sub_df.drop('School Type', axis=1, inplace=True)
@@ -98,8 +107,11 @@ for key, sub_df in sum_school.groupby('School Type'):
         data = sub_df.to_json(orient='records')
         f.write(data)
 
-sum_zips = pd.read_csv('src/summary_stats/sumstats_zips.csv')
+sum_zips = readCSV('src/summary_stats/sumstats_zips.csv')
+profiler.rows(len(sum_zips))
 fname = f'gen/summary/zips.json'
 with open(fname, 'w') as f:
     data = sum_zips.to_json(orient='records')
     f.write(data)
+
+profiler.report()
@@ -0,0 +1,194 @@
+"""Geocoding API client.
+
+Requests are made concurrently from a thread pool sharing one pooled
+session, spaced out to stay under a queries-per-second limit and retried
+with exponential backoff on transient failures (connection errors,
+5xx/429 responses, or the API reporting it's over its limit).
+
+Results are cached in a JSON file. New results are appended to a log
+next to it (`{path}l`, one `[key, value]` per line) as they come in,
+rather than rewriting the whole cache each time, and `compact()` merges
+the log back into the JSON file once done.
+"""
+
+import os
+import json
+import time
+import random
+import threading
+import requests
+from tqdm import tqdm
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+
+GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+
+# Responses worth retrying
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_API_STATUSES = {'OVER_QUERY_LIMIT', 'UNKNOWN_ERROR'}
+
+
+class TransientError(Exception):
+    pass
+
+
+class RateLimiter:
+    """Spaces out calls across threads to at most `qps` per second"""
+    def __init__(self, qps):
+        self.interval = 1/qps if qps else 0
+        self.next = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class GeocodeCache:
+    def __init__(self, path):
+        self.path = path
+        self.log_path = '{}l'.format(path)
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            self.data = {}
+
+        # Replay results logged since the last compaction
+        # (e.g. if the previous run was interrupted)
+        try:
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        key, val = json.loads(line)
+                    except ValueError:
+                        # Partially written last line
+                        continue
+                    self.data[key] = val
+        except FileNotFoundError:
+            pass
+        self.log = None
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def add(self, key, val):
+        with self.lock:
+            self.data[key] = val
+            if self.log is None:
+                self.log = open(self.log_path, 'a')
+            self.log.write(json.dumps([key, val]) + '\n')
+            self.log.flush()
+
+    def compact(self):
+        """Merge logged results into the JSON file"""
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+            if not os.path.exists(self.log_path):
+                return
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.data, f)
+            os.replace(self.path + '.tmp', self.path)
+            os.remove(self.log_path)
+
+
+class GeocodeClient:
+    def __init__(self, key, url=GEOCODE_URL, qps=10, workers=8, retries=5, backoff=0.5, timeout=10):
+        self.key = key
+        self.url = url
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(qps)
+
+        # One connection per worker, reused across requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, params):
+        """Query the API, retrying transient failures, and return its response"""
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                resp = self.session.get(self.url, params={'key': self.key, **params}, timeout=self.timeout)
+                if resp.status_code in RETRY_STATUS_CODES:
+                    raise TransientError('HTTP {}'.format(resp.status_code))
+                resp.raise_for_status()
+                data = resp.json()
+                if data.get('status') in RETRY_API_STATUSES:
+                    raise TransientError(data['status'])
+                return data
+            except (requests.ConnectionError, requests.Timeout, TransientError):
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2**attempt * (1 + random.random()))
+
+    def map(self, fn, items, desc=None):
+        """Run `fn` over `items` across the worker threads, returning results in order"""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(tqdm(pool.map(fn, items), total=len(items), desc=desc))
+
+
+def geocode(client, cache, addrs):
+    """Look up coordinates ({'lat': ..., 'lng': ...}) for addresses
+    that aren't already cached. Returns address -> coordinates,
+    or None if there were no results or the lookup failed"""
+    todo = [addr for addr in dict.fromkeys(addrs) if addr not in cache]
+
+    def fetch(addr):
+        try:
+            data = client.request({'address': addr})
+        except (requests.RequestException, TransientError) as err:
+            # Not cached, so it's tried again next time
+            print('Failed to geocode {}: {}'.format(addr, err))
+            return
+        if not data['results']:
+            print('No results for:', addr)
+            return
+        cache.add(addr, data['results'][0]['geometry']['location'])
+
+    if todo:
+        client.map(fetch, todo, desc='Geocoding')
+    return {addr: cache.get(addr) for addr in addrs}
+
+def coordKey(lat, lng):
+    return '{},{}'.format(lat, lng)
+
+def addressComponents(result):
+    """A result's address components, by type"""
+    return {c['types'][0]: c['short_name'] for c in result['address_components']}
+
+def reverseGeocode(client, cache, coords):
+    """Look up addresses for (lat, lng) coordinates that aren't already
+    cached. Returns, for each coordinate, a list of results' address
+    components by type (e.g. `street_number`, `route`), or an
+    empty list if there were no results or the lookup failed"""
+    todo = [c for c in dict.fromkeys(coords) if coordKey(*c) not in cache]
+
+    def fetch(coord):
+        try:
+            data = client.request({'latlng': coordKey(*coord)})
+        except (requests.RequestException, TransientError) as err:
+            print('Failed to reverse geocode {}: {}'.format(coordKey(*coord), err))
+            return
+        if not data['results']:
+            print('No results for:', coordKey(*coord))
+            return
+        cache.add(coordKey(*coord), [addressComponents(res) for res in data['results']])
+
+    if todo:
+        client.map(fetch, todo, desc='Reverse geocoding')
+    return [cache.get(coordKey(*c)) or [] for c in coords]
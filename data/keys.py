@@ -0,0 +1,124 @@
+"""Registry of category keys, e.g. `SCI.I:30min.S:public.Y:2019`.
+
+Every (field, S, I, Y) combination is assigned an integer id and
+an interned key string up front, so the pipeline can look keys up
+instead of sorting, splitting and joining strings for every value.
+"""
+
+import sys
+from itertools import product
+
+
+def keyForCat(cat, k=None):
+    tags = '.'.join(['{}:{}'.format(c, cat[c]) for c in sorted(cat.keys())])
+    if k:
+        if tags:
+            return '{}.{}'.format(k, tags)
+        else:
+            return k
+    else:
+        return tags
+
+def catsForKey(key):
+    parts = key.split('.')
+    if ':' not in parts[0]:
+        k = parts.pop(0)
+    else:
+        k = None
+    parts = [p.split(':') for p in parts]
+    return {p[0]: p[1] for p in parts}, k
+
+
+class KeyRegistry:
+    def __init__(self, categories, fields):
+        self.categories = categories
+
+        # id -> key string, field, and categories
+        self.keys = []
+        self.fields = []
+        self.cats = []
+
+        # key string -> id
+        self.ids = {}
+
+        # (field, sorted categories) -> id
+        self._lookup = {}
+
+        # (id, dropped tags) -> sub-key id
+        self._sub = {}
+
+        # (tags, fixed, field) -> key strings
+        self._combos = {}
+
+        for k, cats in fields.items():
+            self.keysForCats(cats, k=k)
+
+            # Also register the category-only keys, e.g. `I:30min.Y:2019`
+            self.keysForCats(cats)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _add(self, sig, cat, k):
+        key = sys.intern(keyForCat(cat, k))
+        if key in self.ids:
+            id = self.ids[key]
+        else:
+            id = len(self.keys)
+            self.keys.append(key)
+            self.fields.append(k)
+            self.cats.append(dict(cat))
+            self.ids[key] = id
+        self._lookup[sig] = id
+        return id
+
+    def id(self, cat, k=None):
+        sig = (k, tuple(sorted(cat.items())))
+        try:
+            return self._lookup[sig]
+        except KeyError:
+            return self._add(sig, cat, k)
+
+    def idForKey(self, key):
+        try:
+            return self.ids[key]
+        except KeyError:
+            cat, k = catsForKey(key)
+            return self.id(cat, k)
+
+    def keyForCat(self, cat, k=None):
+        return self.keys[self.id(cat, k)]
+
+    def catsForKey(self, key):
+        id = self.idForKey(key)
+        return self.cats[id], self.fields[id]
+
+    def keysForCats(self, cats, fixed=None, k=None):
+        fixed = fixed or {}
+        sig = (tuple(sorted(cats)), tuple(sorted(fixed.items())), k)
+        try:
+            return self._combos[sig]
+        except KeyError:
+            pass
+
+        tags = sorted(cats)
+        opts = [[fixed[t]] if t in fixed else self.categories[t] for t in tags]
+        keys = [
+            self.keyForCat(dict(zip(tags, p)), k)
+            for p in product(*opts)
+        ]
+        self._combos[sig] = keys
+        return keys
+
+    def subId(self, id, drop):
+        sig = (id, tuple(sorted(drop)))
+        try:
+            return self._sub[sig]
+        except KeyError:
+            keep = {t: v for t, v in self.cats[id].items() if t not in drop}
+            sub = self.id(keep, self.fields[id])
+            self._sub[sig] = sub
+            return sub
+
+    def subKey(self, key, drop):
+        return self.keys[self.subId(self.idForKey(key), drop)]
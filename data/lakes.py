@@ -0,0 +1,32 @@
+"""Clips lakes out of district shapes.
+
+Lakes are loaded once into an STRtree so each shape is only tested
+against lakes whose bounding boxes overlap it, and all intersecting
+lakes are removed with a single `difference`.
+"""
+
+import fiona
+from shapes import GeometryTree
+from shapely.ops import unary_union
+from shapely.prepared import prep
+from shapely.geometry import shape
+
+
+class LakeClipper:
+    def __init__(self, path):
+        self.lakes = [shape(f['geometry']) for f in fiona.open(path)]
+        self.prepared = [prep(lake) for lake in self.lakes]
+        self.tree = GeometryTree(self.lakes)
+
+    def candidates(self, geom):
+        """Indices of lakes whose bounding boxes overlap `geom`"""
+        return [int(i) for i in self.tree.query(geom)]
+
+    def clip(self, geom):
+        """Remove any intersecting lakes from `geom`. Returns
+        the clipped geometry and whether anything was removed"""
+        hits = [i for i in self.candidates(geom) if self.prepared[i].intersects(geom)]
+        if not hits:
+            return geom, False
+        lakes = unary_union([self.lakes[i] for i in hits])
+        return geom.difference(lakes), True
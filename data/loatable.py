@@ -0,0 +1,68 @@
+"""Compact storage for area-level values.
+
+Instead of a dict of key -> value for each LOA (tens of millions of
+small Python objects for ZCTAs), values are kept in one 2D array of
+LOA rows x key columns, with NaN for missing values. Key strings are
+resolved to columns through the shared `KeyRegistry` ids, and values
+are only turned back into Python objects as they're written out.
+"""
+
+import numpy as np
+
+
+class LoaTable:
+    def __init__(self, loas, keys, values, registry, ints=None):
+        self.loas = list(loas)
+        self.keys = list(keys)
+        self.values = values
+        self.registry = registry
+        self.rows = {loa: i for i, loa in enumerate(self.loas)}
+
+        # key id -> column
+        self.cols = {registry.idForKey(key): j for j, key in enumerate(self.keys)}
+
+        # Columns that held only integers, so they're
+        # written out as ints rather than floats
+        if ints is None:
+            ints = np.zeros(len(self.keys), dtype=bool)
+        self.ints = ints
+
+    @classmethod
+    def fromFrame(cls, df, registry, dtype=np.float64):
+        ints = np.array([dt.kind in 'iu' for dt in df.dtypes], dtype=bool)
+        values = df.to_numpy(dtype=dtype, na_value=np.nan)
+        return cls(df.index, df.columns, values, registry, ints=ints)
+
+    def __contains__(self, loa):
+        return loa in self.rows
+
+    def __len__(self):
+        return len(self.loas)
+
+    def columns(self, keys):
+        return np.array([self.cols[self.registry.idForKey(key)] for key in keys], dtype=np.int64)
+
+    def _toPython(self, values, cols):
+        """Rows of Python values, with None for missing values"""
+        out = values.astype(object)
+        ints = self.ints[cols]
+        if ints.any():
+            out[:, ints] = values[:, ints].astype(np.int64).astype(object)
+        out[np.isnan(values)] = None
+        return out.tolist()
+
+    def block(self, keys, loas):
+        """Values for the given keys, as a list of rows for the given LOAs"""
+        cols = self.columns(keys)
+        rows = np.array([self.rows[loa] for loa in loas], dtype=np.int64)
+        return self._toPython(self.values[np.ix_(rows, cols)], cols)
+
+    def row(self, loa):
+        """All of an LOA's values as key -> value,
+        or an empty dict if there's no data for it"""
+        if loa not in self.rows:
+            return {}
+        i = self.rows[loa]
+        cols = np.arange(len(self.keys))
+        vals = self._toPython(self.values[i:i+1], cols)[0]
+        return dict(zip(self.keys, vals))
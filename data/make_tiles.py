@@ -0,0 +1,115 @@
+"""Builds mbtiles from the tile data generated by process_data.py.
+
+Runs tippecanoe over each `gen/tile_data/{LOA}/{key}.geojson`,
+several jobs at a time within a core budget. Outputs whose input
+(and tippecanoe options) haven't changed since the last build are
+skipped. Per-job wall time and sizes are written to `gen/tiles/report.json`.
+"""
+
+import os
+import time
+import json
+import argparse
+import subprocess
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from manifest import Manifest, fingerprint
+
+TILE_DATA = 'gen/tile_data'
+TILES_DIR = 'gen/tiles'
+TIPPECANOE_ARGS = [
+    '-l', 'data', '-P', '-z12',
+    '--coalesce-densest-as-needed', '--hilbert',
+    '--extend-zooms-if-still-dropping', '--generate-ids',
+    '--detect-shared-borders', '-S', '10',
+    '--accumulate-attribute=loa_key:comma', '-D', '11'
+]
+
+
+def outputFor(path):
+    loa = os.path.basename(os.path.dirname(path))
+    name, _ = os.path.splitext(os.path.basename(path))
+    return '{}/{}__{}.mbtiles'.format(TILES_DIR, loa, name)
+
+def runJob(input, output, threads):
+    # Limit each job's threads so that
+    # concurrent jobs stay within the core budget
+    env = {**os.environ, 'TIPPECANOE_MAX_THREADS': str(threads)}
+    start = time.time()
+    proc = subprocess.run(
+        ['tippecanoe', '-f', '-o', output] + TIPPECANOE_ARGS + [input],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    elapsed = time.time() - start
+    if proc.returncode != 0:
+        raise RuntimeError('tippecanoe failed for {}:\n{}'.format(
+            input, proc.stdout.decode('utf8', errors='replace')))
+    return elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cores', type=int, default=os.cpu_count(), help='Total number of cores to use across jobs')
+    parser.add_argument('--jobs', type=int, default=None, help='Max number of tippecanoe jobs to run at once (default: one per input, up to --cores)')
+    parser.add_argument('--force', action='store_true', help='Rebuild all tiles, even if their inputs are unchanged')
+    args = parser.parse_args()
+
+    if not os.path.exists(TILES_DIR):
+        os.makedirs(TILES_DIR)
+    manifest = Manifest('{}/manifest.json'.format(TILES_DIR), force=args.force)
+    try:
+        report = json.load(open('{}/report.json'.format(TILES_DIR)))
+    except FileNotFoundError:
+        report = {}
+
+    # Schedule the largest inputs first, so
+    # the longest jobs don't end up running last
+    inputs = sorted(glob('{}/*/*.geojson'.format(TILE_DATA)), key=os.path.getsize, reverse=True)
+    todo = []
+    fps = {}
+    for input in inputs:
+        output = outputFor(input)
+        fps[output] = fingerprint(manifest.hashFile(input), *TIPPECANOE_ARGS)
+        if manifest.isFresh(output, fps[output]):
+            print('Up to date: {}'.format(output))
+            report.setdefault(output, {})['skipped'] = True
+        else:
+            todo.append((input, output))
+
+    n_jobs = max(1, min(args.jobs or len(todo), len(todo), args.cores))
+    threads = max(1, args.cores//n_jobs)
+    print('Building {}/{} tilesets, {} at a time with {} threads each'.format(
+        len(todo), len(inputs), n_jobs, threads))
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+        futures = {pool.submit(runJob, input, output, threads): (input, output) for input, output in todo}
+        for future in as_completed(futures):
+            input, output = futures[future]
+            try:
+                elapsed = future.result()
+            except RuntimeError as err:
+                print(err)
+                failed.append(output)
+                continue
+            report[output] = {
+                'input': input,
+                'skipped': False,
+                'wall_time': elapsed,
+                'input_size': os.path.getsize(input),
+                'output_size': os.path.getsize(output),
+            }
+            manifest.record(output, fps[output], [output])
+            manifest.save()
+            print('Built {} in {:.1f}s'.format(output, elapsed))
+
+    with open('{}/report.json'.format(TILES_DIR), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    # Show which layers dominate
+    for output, r in sorted(report.items(), key=lambda kv: -kv[1].get('wall_time', 0)):
+        if 'wall_time' not in r: continue
+        print('{:>8.1f}s {:>10.1f}MB  {}{}'.format(
+            r['wall_time'], r['output_size']/1e6, output, ' (skipped)' if r['skipped'] else ''))
+
+    if failed:
+        raise SystemExit('Failed: {}'.format(', '.join(failed)))
@@ -0,0 +1,141 @@
+"""Build manifest for incremental rebuilds.
+
+Records content hashes of a build's inputs and, for each group of
+generated artifacts (e.g. one `by_cat/{key}` directory), the fingerprint
+of the inputs it was built from and a digest of the files it produced.
+A group only needs regenerating if its fingerprint changed or its files
+were modified or removed since.
+"""
+
+import os
+import json
+import hashlib
+import pandas as pd
+
+
+def fingerprint(*parts):
+    h = hashlib.sha1()
+    for part in parts:
+        h.update(str(part).encode('utf8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+def hashFrame(df):
+    """Content hash of a dataframe, including its index and columns"""
+    h = hashlib.sha1()
+    h.update(','.join(str(c) for c in df.columns).encode('utf8'))
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+def hashContents(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def expandPaths(paths):
+    """Expand directories into the files under them"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, fnames in os.walk(path):
+                files += [os.path.join(root, f) for f in fnames]
+        elif os.path.exists(path):
+            files.append(path)
+    return sorted(files)
+
+def shapefilePaths(path):
+    """A shapefile along with its sidecar files"""
+    base, _ = os.path.splitext(path)
+    return [base + ext for ext in ['.shp', '.shx', '.dbf', '.prj', '.cpg']]
+
+
+class Manifest:
+    def __init__(self, path, force=False):
+        self.path = path
+        self.force = force
+        try:
+            with open(path) as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            self.data = {}
+        for k in ['inputs', 'outputs', 'files']:
+            self.data.setdefault(k, {})
+
+    def hashFile(self, path):
+        """Content hash of an input file. Hashes are
+        reused while the file's size and mtime are unchanged"""
+        st = os.stat(path)
+        stat = [st.st_size, st.st_mtime_ns]
+        entry = self.data['inputs'].get(path)
+        if entry is None or entry['stat'] != stat:
+            entry = {'stat': stat, 'hash': hashContents(path)}
+            self.data['inputs'][path] = entry
+        return entry['hash']
+
+    def hashFiles(self, paths):
+        return fingerprint(*[
+            '{}:{}'.format(path, self.hashFile(path))
+            for path in paths if os.path.exists(path)])
+
+    def _statDigest(self, files):
+        parts = []
+        for path in files:
+            st = os.stat(path)
+            parts.append('{}:{}:{}'.format(path, st.st_size, st.st_mtime_ns))
+        return fingerprint(*parts)
+
+    def _contentDigest(self, files):
+        return fingerprint(*['{}:{}'.format(path, hashContents(path)) for path in files])
+
+    def isFresh(self, name, fp):
+        """Whether the artifact group `name` was built from inputs
+        with fingerprint `fp` and its files are unchanged since"""
+        if self.force: return False
+        entry = self.data['outputs'].get(name)
+        if entry is None or entry['fingerprint'] != fp:
+            return False
+
+        files = expandPaths(entry['paths'])
+        if len(files) != entry['count']:
+            return False
+
+        # Only re-hash contents if the files
+        # were touched since they were recorded
+        stat = self._statDigest(files)
+        if stat == entry['stat']:
+            return True
+        if self._contentDigest(files) == entry['digest']:
+            entry['stat'] = stat
+            return True
+        return False
+
+    def record(self, name, fp, paths):
+        """Record the files produced for the artifact group `name`"""
+        files = expandPaths(paths)
+        self.data['outputs'][name] = {
+            'fingerprint': fp,
+            'paths': paths,
+            'count': len(files),
+            'stat': self._statDigest(files),
+            'digest': self._contentDigest(files),
+        }
+
+    def writeIfChanged(self, path, content):
+        """Write a single generated file, skipping it if
+        it already exists with the same contents"""
+        digest = hashlib.sha1(content.encode('utf8')).hexdigest()
+        if not self.force and self.data['files'].get(path) == digest and os.path.exists(path):
+            return False
+        with open(path, 'w') as f:
+            f.write(content)
+        self.data['files'][path] = digest
+        return True
+
+    def save(self):
+        dir = os.path.dirname(self.path)
+        if dir and not os.path.exists(dir):
+            os.makedirs(dir)
+        with open(self.path, 'w') as f:
+            json.dump(self.data, f)
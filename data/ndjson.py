@@ -0,0 +1,83 @@
+"""Newline-delimited JSON, e.g. for tile data
+(one feature per line, so tippecanoe can process in parallel).
+
+Uses orjson if it's installed, falling back to the standard library.
+"""
+
+import os
+
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    loads = orjson.loads
+except ImportError:
+    import json
+
+    def dumps(obj):
+        return json.dumps(obj).encode('utf8')
+
+    loads = json.loads
+
+
+class NDJSONWriter:
+    """Writes each object out as soon as it's given,
+    so only one needs to be held in memory at a time"""
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.f = open(path, 'wb')
+
+    def write(self, obj):
+        if self.count:
+            self.f.write(b'\n')
+        self.f.write(dumps(obj))
+        self.count += 1
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def iterNDJSON(path):
+    """Read objects one line at a time"""
+    with open(path, 'rb') as f:
+        for line in f:
+            if line.strip():
+                yield loads(line)
+
+
+class NDJSONSpill:
+    """Spills (key, obj) pairs to one file per shard as they
+    come in, so they can be read back a shard at a time"""
+    def __init__(self, dir, shardFor):
+        self.dir = dir
+        self.shardFor = shardFor
+        self.writers = {}
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+
+    def write(self, key, obj):
+        shard = self.shardFor(key)
+        if shard not in self.writers:
+            self.writers[shard] = NDJSONWriter('{}/{}.ndjson'.format(self.dir, shard))
+        self.writers[shard].write([key, obj])
+
+    def shards(self):
+        """Yield each shard's (key, obj) pairs, in the order
+        they were written, removing the spill files as they're read"""
+        for writer in self.writers.values():
+            writer.close()
+        for shard, writer in sorted(self.writers.items()):
+            yield shard, [(key, obj) for key, obj in iterNDJSON(writer.path)]
+            os.remove(writer.path)
+        self.writers = {}
+        if not os.listdir(self.dir):
+            os.rmdir(self.dir)
@@ -0,0 +1,179 @@
+"""Geocoding against local files, without network access.
+
+The gazetteer is made up of ZCTA centroids and, optionally, a CSV of
+address points. Results are in the same form as the geocoding API's,
+so they can be used in place of it.
+
+Points are compared as unit vectors, so nearest-neighbour lookups
+are by (chord) distance on the sphere. Uses scipy's KD-tree if it's
+installed, otherwise a chunked brute-force search.
+"""
+
+import re
+import fiona
+import numpy as np
+from csvcache import readCSV
+from shapely.geometry import shape
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+EARTH_RADIUS_KM = 6371.0088
+
+ZCTA_SHAPES = 'src/zctas/tl_2017_us_zcta510.shp'
+ZIP_TO_ZCTA = 'src/zip_to_zcta_2018.csv'
+
+# Trailing ZIP (or ZIP+4) of an address
+ZIP_RE = re.compile(r'(\d{5})(?:-\d{4})?\s*$')
+
+# Values compared at a time in the brute-force search
+CHUNK_SIZE = 2**24
+
+
+def unitVectors(lats, lngs):
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+    return np.column_stack([
+        np.cos(lats) * np.cos(lngs),
+        np.cos(lats) * np.sin(lngs),
+        np.sin(lats)])
+
+
+class PointIndex:
+    """Nearest-neighbour lookups over a set of lat/lng points"""
+    def __init__(self, lats, lngs):
+        self.xyz = unitVectors(lats, lngs)
+        self.tree = cKDTree(self.xyz) if cKDTree is not None else None
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def nearest(self, lats, lngs, max_km=None):
+        """Index of the nearest point to each of the given ones and its
+        distance in km, with -1 if there's none within `max_km`"""
+        query = unitVectors(lats, lngs)
+        if self.tree is not None:
+            chord, idx = self.tree.query(query)
+        else:
+            idx = np.empty(len(query), dtype=np.int64)
+            step = max(1, CHUNK_SIZE // max(1, len(self.xyz)))
+            for i in range(0, len(query), step):
+                # Nearest is the largest dot product
+                idx[i:i+step] = np.argmax(query[i:i+step] @ self.xyz.T, axis=1)
+            chord = np.linalg.norm(query - self.xyz[idx], axis=1)
+        idx = np.asarray(idx, dtype=np.int64)
+        km = 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(chord/2, 0, 1))
+
+        # Missing coordinates match nothing
+        idx[~np.isfinite(km)] = -1
+        if max_km is not None:
+            idx[km > max_km] = -1
+        return idx, km
+
+
+def normalizeStreet(street):
+    """Lowercased, without punctuation or extra whitespace"""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', street.lower()).split())
+
+def zctaCentroids(path):
+    """ZCTA -> (lat, lng) of its internal point, from the
+    shapefile's attributes if it has them, otherwise computed"""
+    centroids = {}
+    with fiona.open(path) as feats:
+        if 'INTPTLAT10' in feats.schema['properties']:
+            # No need to parse the geometries
+            feats = fiona.open(path, ignore_geometry=True)
+        for f in feats:
+            props = f['properties']
+            if 'INTPTLAT10' in props:
+                centroids[props['ZCTA5CE10']] = (float(props['INTPTLAT10']), float(props['INTPTLON10']))
+            else:
+                pt = shape(f['geometry']).representative_point()
+                centroids[props['ZCTA5CE10']] = (pt.y, pt.x)
+    return centroids
+
+
+class Gazetteer:
+    """Forward and reverse geocoding against ZCTA centroids and,
+    optionally, a CSV of address points.
+
+    The address CSV has LATITUDE and LONGITUDE columns, plus columns named
+    for address component types (`street_number`, `route`, `postal_code`, etc).
+    Reverse lookups further than `max_km` from any address point only
+    get the nearest ZCTA"""
+    def __init__(self, addresses=None, zctas=ZCTA_SHAPES, zip_to_zcta=ZIP_TO_ZCTA, max_km=None):
+        self.max_km = max_km
+
+        self.addresses = []
+        self.address_coords = np.empty((0, 2))
+        self.address_index = None
+        self.streets = {}
+        if addresses is not None:
+            df = readCSV(addresses, dtype=str)
+            self.address_coords = df[['LATITUDE', 'LONGITUDE']].astype(float).values
+            self.address_index = PointIndex(self.address_coords[:, 0], self.address_coords[:, 1])
+            components = df.drop(columns=['LATITUDE', 'LONGITUDE'])
+            self.addresses = [
+                {k: v for k, v in addr.items() if isinstance(v, str)}
+                for addr in components.to_dict('records')]
+
+            # For forward lookups, by street address and ZIP
+            for i, addr in enumerate(self.addresses):
+                if 'route' not in addr:
+                    continue
+                street = normalizeStreet('{} {}'.format(addr.get('street_number', ''), addr['route']))
+                self.streets.setdefault((street, addr.get('postal_code', '')[:5]), i)
+
+        self.zctas = zctaCentroids(zctas) if zctas is not None else {}
+        self.zcta_keys = list(self.zctas.keys())
+        zcta_coords = np.array([self.zctas[k] for k in self.zcta_keys]).reshape(-1, 2)
+        self.zcta_index = PointIndex(zcta_coords[:, 0], zcta_coords[:, 1])
+
+        self.zip_to_zcta = {}
+        if zip_to_zcta is not None:
+            zips = readCSV(zip_to_zcta, dtype={'ZIP_CODE': str, 'ZCTA': str}, columns=['ZIP_CODE', 'ZCTA'])
+            self.zip_to_zcta = dict(zip(zips['ZIP_CODE'], zips['ZCTA']))
+
+    def _forward(self, addr):
+        street = normalizeStreet(addr.split(',')[0])
+        match = ZIP_RE.search(addr)
+        zip = match.group(1) if match else ''
+        for key in [(street, zip), (street, '')]:
+            if key in self.streets:
+                lat, lng = self.address_coords[self.streets[key]]
+                return {'lat': float(lat), 'lng': float(lng)}
+
+        # Fall back to the centroid of the ZIP's ZCTA
+        zcta = self.zip_to_zcta.get(zip, zip)
+        if zcta in self.zctas:
+            lat, lng = self.zctas[zcta]
+            return {'lat': lat, 'lng': lng}
+        return None
+
+    def geocode(self, addrs):
+        """Coordinates ({'lat': ..., 'lng': ...}) for addresses, as in
+        `geocoding.geocode`: an address point matching the street address
+        and ZIP if there is one, otherwise the centroid of the ZIP's ZCTA"""
+        return {addr: self._forward(addr) for addr in addrs}
+
+    def reverse(self, coords):
+        """Results for (lat, lng) coordinates, as in `geocoding.reverseGeocode`:
+        the nearest address point's components (if within `max_km`),
+        then the nearest ZCTA as a `postal_code`"""
+        if not coords:
+            return []
+        lats, lngs = zip(*coords)
+        results = [[] for _ in coords]
+        if self.address_index is not None:
+            idx, _ = self.address_index.nearest(lats, lngs, max_km=self.max_km)
+            for res, i in zip(results, idx):
+                if i >= 0:
+                    res.append(self.addresses[i])
+        if len(self.zcta_index):
+            idx, _ = self.zcta_index.nearest(lats, lngs)
+            for res, i in zip(results, idx):
+                if i >= 0:
+                    res.append({'postal_code': self.zcta_keys[i]})
+        return results
@@ -0,0 +1,94 @@
+"""Packed output format.
+
+Instead of one small JSON file per record (e.g. per LOA in
+`by_cat/{key}/`), records are grouped into shards. Each shard is
+a `{shard}.pack` file of concatenated JSON documents, with a
+`{shard}.index.json` mapping each record key to its `[offset, length]`
+in the pack, so a record can be fetched with an HTTP range request.
+
+Records are JSON-encoded as ASCII, so byte and character offsets match.
+"""
+
+import os
+import json
+from collections import defaultdict
+
+# Shard by-LOA records on the first digits of the LOA key
+# (i.e. roughly by state), and schools on blocks of ids
+LOA_PREFIX_LEN = 2
+SCHOOL_BLOCK_SIZE = 1000
+
+
+def prefixShard(n):
+    return lambda key: str(key)[:n]
+
+def blockShard(size):
+    return lambda key: str(int(key)//size)
+
+def pack(records):
+    """Pack (key, obj) records into a
+    single string and an offset index"""
+    chunks, index, offset = [], {}, 0
+    for key, obj in records:
+        chunk = json.dumps(obj)
+        index[str(key)] = [offset, len(chunk)]
+        chunks.append(chunk)
+        offset += len(chunk)
+    return ''.join(chunks), index
+
+def writePacks(dir, records, shardFor, write=None):
+    """Group (key, obj) records into shards and write each
+    shard's pack and index. `write(path, content)` can be given
+    to e.g. skip unchanged files. Returns the paths written to"""
+    if write is None:
+        write = writeFile
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+
+    shards = defaultdict(list)
+    for key, obj in records:
+        shards[shardFor(key)].append((key, obj))
+
+    paths = []
+    for shard, recs in sorted(shards.items()):
+        content, index = pack(recs)
+        pack_path = '{}/{}.pack'.format(dir, shard)
+        index_path = '{}/{}.index.json'.format(dir, shard)
+        write(pack_path, content)
+        write(index_path, json.dumps(index))
+        paths += [pack_path, index_path]
+    return paths
+
+def writeFile(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+class PackReader:
+    """Look up individual records from packed shards"""
+    def __init__(self, dir, shardFor):
+        self.dir = dir
+        self.shardFor = shardFor
+        self._indices = {}
+
+    def index(self, shard):
+        if shard not in self._indices:
+            with open('{}/{}.index.json'.format(self.dir, shard)) as f:
+                self._indices[shard] = json.load(f)
+        return self._indices[shard]
+
+    def get(self, key):
+        shard = self.shardFor(key)
+        try:
+            offset, length = self.index(shard)[str(key)]
+        except (FileNotFoundError, KeyError):
+            raise KeyError(key)
+        with open('{}/{}.pack'.format(self.dir, shard), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def __contains__(self, key):
+        try:
+            return str(key) in self.index(self.shardFor(key))
+        except FileNotFoundError:
+            return False
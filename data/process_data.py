@@ -6,16 +6,27 @@ are replaced w/ "_"
 """
 
 import os
-import sys
-import math
-import ftfy
 import json
 import fiona
 import numpy as np
 import pandas as pd
+import argparse
+import multiprocessing
 from tqdm import tqdm
-from itertools import product
+from keys import KeyRegistry
+from stats import KeyStats
+from csvcache import readCSV
+from loatable import LoaTable
+from manifest import Manifest, fingerprint, hashFrame, shapefilePaths
+from lakes import LakeClipper
+from shapes import ShapeIndex
+from ndjson import NDJSONWriter, NDJSONSpill
+import textfix
+from schoolkeys import SchoolKeyIndex, KEY_COLS
+from profiling import Profiler
+from packed import writePacks, prefixShard, blockShard, LOA_PREFIX_LEN, SCHOOL_BLOCK_SIZE
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from shapely.geometry import shape, mapping
 
 # For plotting shapes
@@ -24,8 +35,19 @@ from shapely.geometry import shape, mapping
 # gpd.GeoSeries(shape(f['geometry'])).plot()
 # plt.show()
 
+parser = argparse.ArgumentParser()
+parser.add_argument('loa', choices=['ZCTA', 'CD'], help='Level of analysis')
+parser.add_argument('--jobs', type=int, default=1, help='Number of processes to shard (I, Y) slices across')
+parser.add_argument('--force', action='store_true', help='Rebuild everything, ignoring the build manifest')
+parser.add_argument('--packed', action='store_true', help='Write by_cat, bbox and school data as sharded packs instead of one file each')
+parser.add_argument('--stream', action='store_true', help='Process and write out one year at a time, to bound memory use')
+args = parser.parse_args()
+
 # loa = Level of analysis
-LOA = sys.argv[1] # 'ZCTA' OR 'CD'
+LOA = args.loa
+JOBS = args.jobs
+
+profiler = Profiler('process_data.{}'.format(LOA))
 
 # For CD, need to change the column names in CD_Level.45.min.csv:
 # %s/AVG_LOCAL_//
@@ -172,6 +194,11 @@ RANGE_MAXS = {
     'MEDIANINCOME': 40000,
 }
 
+# Summary statistics to include in meta.json.
+# Any of 'mean', 'median', 'min', 'max',
+# or a quantile such as 'q25' can be used
+SUMMARY_STATS = ['min']
+
 # Keep only non-varying properties
 # for school geojson
 SCHOOL_GEOJSON_PROPS = [
@@ -183,121 +210,135 @@ SCHOOL_GEOJSON_PROPS = [
     'ICLEVEL', 'CONTROL',
 ]
 
-def keysForCats(cats, fixed=None, k=None):
-    fixed = fixed or {}
-    tags = sorted(cats)
-    opts = [[fixed[t]] if t in fixed else CATEGORIES[t] for t in tags]
-    keys = [
-        '.'.join('{}:{}'.format(t, c) for t, c in zip(tags, p))
-        for p in product(*opts)
-    ]
-    if k:
-        return ['{}.{}'.format(k, key) for key in keys]
-    else:
-        return keys
-
-def keyForCat(cat, k=None):
-    tags = '.'.join(['{}:{}'.format(c, cat[c]) for c in sorted(cat.keys())])
-    if k:
-        if tags:
-            return '{}.{}'.format(k, tags)
+# Precompute every category key once
+KEYS = KeyRegistry(CATEGORIES, {**FEAT_FIELDS, **QUERY_FIELDS})
+
+
+def areaColumns(fields, cat):
+    """Map each (field, key) to the area-level
+    CSV column it is read from, for the given Y and I"""
+    columns = []
+    for k, cats in fields.items():
+        # LOA year-level stats
+        if cats == ['Y']:
+            columns.append((k, KEYS.keyForCat({'Y': cat['Y']}, k), k))
+        elif 'I' not in cats: continue
+        elif 'S' in cats:
+            for s in CATEGORIES['S']:
+                s_ = KEY_FIXES_MAP.get(s, s)
+                key = KEYS.keyForCat({'Y': cat['Y'], 'I': cat['I'], 'S': s}, k)
+                columns.append((k, key, '{}_{}'.format(k, s_)))
         else:
-            return k
-    else:
-        return tags
-
-def catsForKey(key):
-    parts = key.split('.')
-    if ':' not in parts[0]:
-        k = parts.pop(0)
-    else:
-        k = None
-    parts = [p.split(':') for p in parts]
-    return {p[0]: p[1] for p in parts}, k
-
-def subKey(key, drop):
-    cats, k = catsForKey(key)
-    keep = {k: v for k, v in cats.items() if k not in drop}
-    return keyForCat(keep, k=k)
-
-
-loa_keys = set()
-data = defaultdict(dict)
-query_data = defaultdict(dict)
-field_data = defaultdict(lambda: defaultdict(list))
-for i in CATEGORIES['I']:
-    df_all = pd.read_csv(AREA_LEVEL_PATH.format(I=i))
+            columns.append((k, KEYS.keyForCat({t: cat[t] for t in cats}, k), k))
+    return columns
+
+def joinTables(tables):
+    """Join the per-(I, Y) wide tables into
+    one LOA x key table"""
+    wide = pd.concat(tables, axis=1)
+
+    # Year-level stats are repeated in each
+    # isochrone's CSV; the last one wins
+    return wide.loc[:, ~wide.columns.duplicated(keep='last')]
+
+
+def runJobs(fn, jobs, desc=None):
+    """Run `fn` for each tuple of arguments in `jobs`,
+    across JOBS processes if more than one. Results come back
+    in the order of `jobs`, so merging them is deterministic"""
+    if JOBS > 1:
+        # Fork so workers share what's already loaded
+        # (query data, school lookups, etc)
+        ctx = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=JOBS, mp_context=ctx) as pool:
+            futures = [pool.submit(fn, *a) for a in jobs]
+            return [f.result() for f in tqdm(futures, desc=desc)]
+    return [fn(*a) for a in tqdm(jobs, desc=desc)]
+
+def ingestArea(i):
+    """Columnar ingest: rather than walking each row,
+    slice each year of an isochrone's area-level CSV
+    into wide tables indexed by LOA key, with columns
+    renamed to their output keys"""
+    # Only load the columns that are used
+    columns = [CSV_LOA_FIELD, 'YEAR']
+    for fields in [FEAT_FIELDS, QUERY_FIELDS]:
+        for _, _, col in areaColumns(fields, {'Y': CATEGORIES['Y'][0], 'I': i}):
+            if col not in columns:
+                columns.append(col)
+    df_all = readCSV(AREA_LEVEL_PATH.format(I=i), columns=columns)
+    df_all = df_all[df_all[CSV_LOA_FIELD].notnull()]
+    df_all.index = df_all[CSV_LOA_FIELD].astype(int).astype(str).str.zfill(LOA_FIELD_DIGITS)
     groups = df_all.groupby('YEAR')
+
+    slices = []
     for y in CATEGORIES['Y']:
         cat = {'Y': y, 'I': i}
         df = groups.get_group(int(y))
-        df = df.where(pd.notnull(df), None)
-        for row in tqdm(df.itertuples(), total=len(df), desc='{Y}/{I} {loa}'.format(**cat, loa=LOA)):
-            row_data = dict(row._asdict())
-            if row_data[CSV_LOA_FIELD] is None or math.isnan(row_data[CSV_LOA_FIELD]): continue
-            loa_key = str(int(row_data[CSV_LOA_FIELD])).zfill(LOA_FIELD_DIGITS)
-            loa_keys.add(loa_key)
-
-            for datadict, fields in [(data, FEAT_FIELDS), (query_data, QUERY_FIELDS)]:
-                for k, cats in fields.items():
-                    # LOA year-level stats
-                    if cats == ['Y']:
-                        key = keyForCat({'Y': y}, k)
-                        val = row_data[k]
-                        datadict[loa_key][key] = val
-                        field_data[k][key].append(val)
-
-                    elif 'I' not in cats: continue
-                    elif 'S' in cats:
-                        for s in CATEGORIES['S']:
-                            s_ = KEY_FIXES_MAP.get(s, s)
-                            key = keyForCat({'Y': y, 'I': i, 'S': s}, k)
-                            val = row_data['{}_{}'.format(k, s_)]
-                            datadict[loa_key][key] = val
-                            field_data[k][key].append(val)
-
-                            # if k == 'AVGNP' and val is not None and val > 75000:
-                            #     print(f'{zipcode} y={y},i={i},s={s} -> {val}')
-                    else:
-                        key = keyForCat({t: cat[t] for t in cats}, k)
-                        datadict[loa_key][key] = row_data[k]
-                        field_data[k][key].append(val)
+        df = df[~df.index.duplicated(keep='last')]
+        year_tables = {}
+        for name, fields in [('data', FEAT_FIELDS), ('query_data', QUERY_FIELDS)]:
+            columns = areaColumns(fields, cat)
+            wide = df[[col for _, _, col in columns]]
+            wide.columns = [key for _, key, _ in columns]
+            year_tables[name] = wide
+        slices.append(year_tables)
+    return slices
+
+
+# Tracks what inputs each output was built from,
+# so unchanged outputs can be skipped
+manifest = Manifest('gen/{}/manifest.json'.format(LOA), force=args.force)
+
+profiler.start('ingest')
+loa_keys = set()
+tables = {'data': [], 'query_data': []}
+for slices in runJobs(ingestArea, [(i,) for i in CATEGORIES['I']], desc='{} Data'.format(LOA)):
+    for year_tables in slices:
+        loa_keys.update(year_tables['data'].index)
+        profiler.rows(len(year_tables['data']))
+        for name, wide in year_tables.items():
+            tables[name].append(wide)
+
+data_table = joinTables(tables['data'])
+data = LoaTable.fromFrame(data_table, KEYS)
+stats = KeyStats(data.keys, data.values)
+data_hash = hashFrame(data_table)
+
+# Hash the query data going into each (Y, I) slice
+query_table = joinTables(tables['query_data'])
+query_hashes = {}
+for y in CATEGORIES['Y']:
+    for i in CATEGORIES['I']:
+        cat = {'Y': y, 'I': i}
+        fullkeys = [fullkey for k, cats in QUERY_FIELDS.items()
+                    for fullkey in KEYS.keysForCats(cats, fixed=cat, k=k)]
+        query_hashes[KEYS.keyForCat(cat)] = hashFrame(query_table[fullkeys])
+query_data = LoaTable.fromFrame(query_table, KEYS)
+del tables, data_table, query_table
 
 # Compute ranges
+profiler.start('stats')
 meta = {}
 meta['ranges'] = {}
-for k in FEAT_FIELDS.keys():
-    vals = []
+for k, cats in FEAT_FIELDS.items():
     # Get min/max across all categories
-    for K, vs in field_data[k].items():
-        vs = [v for v in vs if v is not None]
-        if vs:
-            vals.append(float(min(vs)))
-            vals.append(float(max(vs)))
-
-    mn = RANGE_MINS.get(k, min(vals))
-    mx = RANGE_MAXS.get(k, max(vals))
+    mn, mx = stats.range(KEYS.keysForCats(cats, k=k))
+    mn = RANGE_MINS.get(k, mn)
+    mx = RANGE_MAXS.get(k, mx)
     meta['ranges'][k] = (mn, mx)
 
-# import ipdb; ipdb.set_trace()
-
 # Compute summary statistics (within categories)
 # To keep file size smaller, just using min
-# for s in ['mean', 'median', 'min', 'max']:
-for s in ['min']:
+for s in SUMMARY_STATS:
     meta[s] = {}
     for k, cats in FEAT_FIELDS.items():
-        for key in keysForCats(cats):
-            key = '{}.{}'.format(k, key)
-            vals = [v for v in field_data[k][key] if v is not None]
-            try:
-                meta[s][key] = float(getattr(np, s)(vals))
-            except ValueError:
-                # Probably missing that year's data
-                meta[s][key] = None
+        # None if probably missing that year's data
+        meta[s].update(stats.summary(s, KEYS.keysForCats(cats, k=k)))
 
 
 # School-level data
+profiler.start('school list')
 # Associate schools with LOAs and load school data
 # TODO how to do this with minimal redundancy
 schools_by_year = defaultdict(dict)
@@ -305,33 +346,48 @@ schools_geojson = {
     'type': 'FeatureCollection',
     'features': []
 }
-data_by_key_loa = defaultdict(lambda: defaultdict(lambda: {'schools': []}))
 
 # School-level
 school_feats = {}
-all_years = pd.read_csv('src/Master_SchoolList.csv',
+all_years = readCSV('src/Master_SchoolList.csv',
         encoding='ISO-8859-1',
-        dtype={'YEAR': str, 'ZIP': str})
+        dtype={'YEAR': str, 'ZIP': str},
+        columns=KEY_COLS + ['YEAR', 'ZIP', 'LATITUDE', 'LONGITUD'] + [k for k in SCHOOL_FIELDS if k not in KEY_COLS])
 
 # Mapbox does not allow string feature ids,
 # so we have to convert these to uints
 # <https://github.com/mapbox/mapbox-gl-js/issues/2716>
-schoolidx_to_featid = {}
-for i, key in enumerate(all_years.groupby(['UNITID', 'ADDR', 'MAPNAME']).groups.keys()):
+# Ids are kept from previous builds (shared across LOAs),
+# so that new schools don't renumber existing ones
+try:
+    schoolidx_to_featid = json.load(open('gen/school_ids.json'))
+except FileNotFoundError:
+    schoolidx_to_featid = {}
+next_id = max(schoolidx_to_featid.values(), default=-1) + 1
+for key in all_years.groupby(['UNITID', 'ADDR', 'MAPNAME']).groups.keys():
     schoolkey = '__'.join(str(k) for k in key)
-    schoolidx_to_featid[schoolkey] = i
+    if schoolkey not in schoolidx_to_featid:
+        schoolidx_to_featid[schoolkey] = next_id
+        next_id += 1
 
 all_years = all_years.groupby('YEAR')
 reverse_geocode_lookup = json.load(open('gen/reverse_geocode_lookup.json'))
 coordinate_corrections = json.load(open('gen/coordinate_corrections.json'))
-for y in CATEGORIES['Y']:
+year_schools = defaultdict(list)
+
+def schoolYear(y):
+    """Load one year of the school list, returning
+    each school's id and record for that year"""
+    records = []
     # TODO these are overwriting each year atm
     df = all_years.get_group(y)
     df = df.where((pd.notnull(df)), None)
+    profiler.rows(len(df))
     for row in tqdm(df.itertuples(), total=len(df), desc='{} School List'.format(y)):
         row_data = dict(row._asdict())
         schoolkey = '__'.join(str(v) if v is not None else 'nan' for v in [row_data[k] for k in ['UNITID', 'ADDR', 'MAPNAME']])
         id = schoolidx_to_featid[schoolkey]
+        year_schools[y].append('{}={}'.format(schoolkey, id))
         fixed_coords = coordinate_corrections.get(schoolkey, {})
 
         # Get zipcode into proper format
@@ -340,12 +396,15 @@ for y in CATEGORIES['Y']:
         if len(zipcode) < 5:
             zipcode = str(int(zipcode)).zfill(5)
 
-        schools_by_year[id][y] = {k: row_data[k] for k in SCHOOL_FIELDS}
-        schools_by_year[id][y]['ZIP'] = zipcode
-        schools_by_year[id][y]['id'] = id
+        # where() above leaves NaN in float columns, which json.dump
+        # would write out as (invalid) NaN rather than null
+        record = {k: None if pd.isnull(row_data[k]) else row_data[k] for k in SCHOOL_FIELDS}
+        record['ZIP'] = zipcode
+        record['id'] = id
+        records.append((id, record))
 
         if id not in school_feats:
-            props = {k: schools_by_year[id][y][k] for k in SCHOOL_GEOJSON_PROPS}
+            props = {k: record[k] for k in SCHOOL_GEOJSON_PROPS}
             props['years'] = []
 
             # Get corrected coordinates, if any
@@ -364,43 +423,139 @@ for y in CATEGORIES['Y']:
                 'properties': props
             }
         school_feats[id]['properties']['years'].append(y)
+    return records
 
-    for i in CATEGORIES['I']:
-        cat = {'Y': y, 'I': i}
-        key = keyForCat(cat)
-        fname = ZONE_LEVEL_PATH.format(**cat)
-        try:
-            df = pd.read_csv(fname, encoding='ISO-8859-1')
-        except FileNotFoundError:
-            print('Missing {}'.format(fname))
-            continue
-        for row in tqdm(df.itertuples(), total=len(df), desc='{Y}/{I} School Zones'.format(**cat)):
-            row_data = dict(row._asdict())
-            if row_data[ZONE_LOA_FIELD] is None or math.isnan(row_data[ZONE_LOA_FIELD]): continue
-            loa_key = str(int(row_data[ZONE_LOA_FIELD])).zfill(LOA_FIELD_DIGITS)
-            if not isinstance(row_data['ADDR'], str):
-                lat, lng = row_data['LATITUDE'], row_data['LONGITUD']
-                row_data['ADDR'] = reverse_geocode_lookup['{},{}'.format(lat, lng)]
-            # Use ftfy to fix encoding issues (double encoded utf8, I believe)
-            schoolkey = '__'.join(ftfy.fix_text(str(v)) if v is not None else 'nan' for v in [row_data[k] for k in ['UNITID', 'ADDR', 'MAPNAME']])
-            id = schoolidx_to_featid[schoolkey]
-            data_by_key_loa[key][loa_key]['schools'].append(id)
-
-        # Zip level data
-        key_map = {}
-        for k, cats in QUERY_FIELDS.items():
-            for fullkey in keysForCats(cats, fixed=cat, k=k):
-                subkey = subKey(fullkey, drop=cat)
-                key_map[fullkey] = subkey
-        for loa_key in tqdm(loa_keys, desc='{Y}/{I} {loa} Data'.format(**cat, loa=LOA)):
-            for fullkey, subkey in key_map.items():
-                data_by_key_loa[key][loa_key][subkey] = query_data[loa_key][fullkey]
+
+def readZones(y, i):
+    """Read one (Y, I) slice's school zones, as each row's LOA and
+    which of the slice's unique (UNITID, ADDR, MAPNAME) it's for"""
+    fname = ZONE_LEVEL_PATH.format(Y=y, I=i)
+    try:
+        df = readCSV(fname, encoding='ISO-8859-1',
+                columns=[ZONE_LOA_FIELD, 'LATITUDE', 'LONGITUD'] + KEY_COLS)
+    except FileNotFoundError:
+        print('Missing {}'.format(fname))
+        return None
+    df = df[df[ZONE_LOA_FIELD].notnull()].copy()
+
+    missing = df['ADDR'].isnull()
+    df.loc[missing, 'ADDR'] = [reverse_geocode_lookup['{},{}'.format(lat, lng)]
+            for lat, lng in zip(df.loc[missing, 'LATITUDE'], df.loc[missing, 'LONGITUD'])]
+
+    schools = df[KEY_COLS].drop_duplicates()
+    codes = df[KEY_COLS].merge(
+            schools.assign(code=np.arange(len(schools))),
+            on=KEY_COLS, how='left')['code'].to_numpy()
+    return df[ZONE_LOA_FIELD].to_numpy(dtype=np.int64), codes, schools
+
+def zoneSchools(loas, codes, schools):
+    """Group school ids by LOA, keeping
+    the LOAs' and schools' file order"""
+    ids = school_keys.ids(schools)[codes]
+    order = np.argsort(loas, kind='stable')
+    uniq, starts = np.unique(loas[order], return_index=True)
+    groups = np.split(ids[order], starts[1:])
+    return {str(uniq[j]).zfill(LOA_FIELD_DIGITS): groups[j].tolist()
+            for j in np.argsort(order[starts], kind='stable')}
+
+def zoneSlice(y, i):
+    """Fan out the LOAs' query data for one
+    (Y, I) slice, as LOA -> {schools, data}"""
+    cat = {'Y': y, 'I': i}
+    if (y, i) not in zone_schools:
+        return None
+
+    by_loa = defaultdict(lambda: {'schools': []})
+    for loa_key, ids in zone_schools[(y, i)].items():
+        by_loa[loa_key]['schools'] = ids
+
+    # Zip level data, as one slice of the query data
+    fullkeys = [fullkey for k, cats in QUERY_FIELDS.items()
+                for fullkey in KEYS.keysForCats(cats, fixed=cat, k=k)]
+    subkeys = [KEYS.subKey(fullkey, drop=cat) for fullkey in fullkeys]
+    ordered = sorted(loa_keys)
+    for loa_key, vals in zip(ordered, query_data.block(fullkeys, ordered)):
+        by_loa[loa_key].update(zip(subkeys, vals))
+    return dict(by_loa)
+
+def sliceFingerprint(y, i):
+    """Fingerprint of everything a (Y, I) slice's
+    by_cat outputs are built from"""
+    key = KEYS.keyForCat({'Y': y, 'I': i})
+    return fingerprint(
+        manifest.hashFiles([ZONE_LEVEL_PATH.format(Y=y, I=i), 'gen/reverse_geocode_lookup.json']),
+        query_hashes[key],
+        fingerprint(*sorted(year_schools[y])),
+        args.packed)
+
+def writeSlice(key, by_loa):
+    path = '{}/{}'.format(loa_path, key)
+    if args.packed:
+        writePacks(path, sorted(by_loa.items()), prefixShard(LOA_PREFIX_LEN))
+    else:
+        if not os.path.exists(path):
+            os.makedirs(path)
+        for loa_key, schools in by_loa.items():
+            with open('{}/{}.json'.format(path, loa_key), 'w') as f:
+                    json.dump(schools, f)
+    manifest.record('by_cat/{}'.format(key), slice_fps[key], [path])
+
+def runSlices(batch):
+    """Build and write out the by_cat data for
+    the (Y, I) slices in `batch` whose inputs changed"""
+    slices = []
+    for y, i in batch:
+        key = KEYS.keyForCat({'Y': y, 'I': i})
+        slice_fps[key] = sliceFingerprint(y, i)
+        if not manifest.isFresh('by_cat/{}'.format(key), slice_fps[key]):
+            slices.append((y, i))
+    print('{}/{} slices changed'.format(len(slices), len(batch)))
+
+    # Associate schools with LOAs. Zone files are read in parallel,
+    # then matched against one school key index shared by all of them
+    zone_schools.clear()
+    for (y, i), zones in zip(slices, runJobs(readZones, slices, desc='Reading School Zones')):
+        if zones is None: continue
+        profiler.rows(len(zones[0]))
+        zone_schools[(y, i)] = zoneSchools(*zones)
+
+    for (y, i), by_loa in zip(slices, runJobs(zoneSlice, slices, desc='School Zones')):
+        if by_loa is None: continue
+        writeSlice(KEYS.keyForCat({'Y': y, 'I': i}), by_loa)
+
+loa_path = 'gen/{}/by_cat'.format(LOA)
+if not os.path.exists(loa_path):
+    os.makedirs(loa_path)
+slice_fps = {}
+zone_schools = {}
+school_keys = SchoolKeyIndex(schoolidx_to_featid)
+
+# When streaming, each year's by_cat data is written out as soon
+# as it's done, and school records are spilled to disk to be
+# put together at the end, one shard of schools at a time
+if args.stream:
+    school_spill = NDJSONSpill('gen/.school_spill', blockShard(SCHOOL_BLOCK_SIZE))
+    for y in CATEGORIES['Y']:
+        profiler.start('school list')
+        for id, record in schoolYear(y):
+            school_spill.write(id, [y, record])
+        profiler.start('zones')
+        runSlices([(y, i) for i in CATEGORIES['I']])
+else:
+    for y in CATEGORIES['Y']:
+        for id, record in schoolYear(y):
+            schools_by_year[id][y] = record
+    profiler.start('zones')
+    runSlices([(y, i) for y in CATEGORIES['Y'] for i in CATEGORIES['I']])
+textfix.fixer.save()
+print(textfix.fixer.report())
 
 for school in school_feats.values():
     school['properties']['years'] = ','.join(school['properties']['years'])
     schools_geojson['features'].append(school)
 
 # Get missing features to fill in
+profiler.start('geometry')
 ref_geojson = json.load(open(REF_GEOJSON))
 for f in ref_geojson['features']:
     loa_key = f['properties'][SHAPE_LOA_FIELD]
@@ -436,94 +591,99 @@ region_bboxes['Alaska'] = [-207.4133546365765, 50.796925749084465, -104.93451956
 region_bboxes['American Samoa'] = [-171.84922996050645, -14.93534547358692, -168.25721358668446, -13.663497668009555]
 
 NON_MAINLAND_STATES = ['72', '78', '60', '66', '69', '02', '15']
+
+# Set to None to clip lakes from districts in all states
 REMOVE_LAKES_FROM = ['55', '26'] # WI, MI
-LAKES = [shape(s['geometry']) for s in fiona.open('src/lakes/ne_10m_lakes.shp')]
+LAKES_PATH = 'src/lakes/ne_10m_lakes.shp'
+LAKES = LakeClipper(LAKES_PATH) if LOA == 'CD' else None
+
+def buildFeature(f, keys=None, cat=None):
+    """Prepare a shape's feature for the tile data,
+    returning it along with its bounding box"""
+    f = {k: v for k, v in f.items() if k != 'id'}
+    geom = shape(f['geometry'])
+
+    # Trim districts to state land boundaries
+    if LOA == 'CD':
+        statefp = f['properties']['STATEFP']
+        if REMOVE_LAKES_FROM is None or statefp in REMOVE_LAKES_FROM:
+            geom, clipped = LAKES.clip(geom)
+            if clipped:
+                f['geometry'] = mapping(geom)
+
+    loa_key = f['properties'][SHAPE_LOA_FIELD]
+
+    # Only keep non-null values
+    props = {k: v for k, v in data.row(loa_key).items() if v is not None}
+
+    # Drop extraneous properties
+    if keys is not None:
+        props = {KEYS.subKey(k, drop=cat): props[k] for k in keys if k in props}
+
+    # Keep STATEFP
+    if LOA == 'CD':
+        props['STATEFP'] = statefp
+
+    props['loa_key'] = loa_key
+    f['properties'] = props
+    return f, geom.bounds
 
 # Build geojson
 bboxes = {}
 if MAPS_BY:
-    map_keys = keysForCats(MAPS_BY)
+    map_keys = KEYS.keysForCats(MAPS_BY)
 else:
     map_keys = ['ALL']
+
+tile_paths = ['gen/tile_data/{}/{}.geojson'.format(LOA, key) for key in map_keys]
+tile_paths.append('gen/{}/bboxes'.format(LOA))
+tiles_fp = fingerprint(
+    data_hash, MAPS_BY, REMOVE_LAKES_FROM, args.packed,
+    manifest.hashFiles([REF_GEOJSON] + shapefilePaths(SHAPES_PATH) + shapefilePaths(LAKES_PATH)))
+tiles_fresh = manifest.isFresh('tile_data', tiles_fp)
+if tiles_fresh:
+    print('Tile data is up to date')
+    map_keys = []
+
+# LOAs missing from the reference geojson,
+# fetched by key from the full shapefile
+missing_feats = []
+if loa_keys and map_keys:
+    shapes = ShapeIndex(SHAPES_PATH, SHAPE_LOA_FIELD,
+                        cache_path='gen/{}/shapes.index.json'.format(LOA))
+    missing_feats = list(shapes.features(loa_keys))
+
 for key in map_keys:
     # Figure out what data keys we use for this map
     if key != 'ALL':
         keys = []
-        cat, _ = catsForKey(key)
+        cat, _ = KEYS.catsForKey(key)
         for k, cats in FEAT_FIELDS.items():
-            keys += keysForCats(cats, fixed=cat, k=k)
+            keys += KEYS.keysForCats(cats, fixed=cat, k=k)
     else:
-        keys = None
-
-    geojson = []
-    for f in tqdm(ref_geojson['features'], desc='Geojson for {}'.format(key)):
-        f = {**f}
-        if 'id' in f:
-            del f['id']
-
-        # Trim districts to state land boundaries
-        if LOA == 'CD':
-            statefp = f['properties']['STATEFP']
-            if statefp in REMOVE_LAKES_FROM:
-                for lake in LAKES:
-                    if shape(f['geometry']).intersects(lake):
-                        f['geometry'] = mapping(shape(f['geometry']).difference(lake))
-
-        loa_key = f['properties'][SHAPE_LOA_FIELD]
-
-        # Only keep non-null values
-        f['properties'] = {k: v for k, v in data[loa_key].items() if v is not None}
-
-        # Drop extraneous properties
-        if keys is not None:
-            f['properties'] = {subKey(k, drop=cat): f['properties'][k] for k in keys}
-
-        # Keep STATEFP
-        if LOA == 'CD':
-            f['properties']['STATEFP'] = statefp
-
-        f['properties']['loa_key'] = loa_key
-
-        bboxes[loa_key] = shape(f['geometry']).bounds
-        geojson.append(f)
-
-    # Fill in leftover zctas
-    if loa_keys:
-        for f in tqdm(fiona.open(SHAPES_PATH), desc='Filling missing {}s'.format(LOA)):
-            loa_key = f['properties'][SHAPE_LOA_FIELD]
-            if loa_key not in loa_keys: continue
-
-            # Trim districts to state land boundaries
-            if LOA == 'CD':
-                statefp = f['properties']['STATEFP']
-                if statefp in REMOVE_LAKES_FROM:
-                    for lake in LAKES:
-                        if shape(f['geometry']).intersects(lake):
-                            f['geometry'] = mapping(shape(f['geometry']).difference(lake))
-
-            # Only keep non-null values
-            f['properties'] = {k: v for k, v in data[loa_key].items() if v is not None}
-
-            # Keep STATEFP
-            if LOA == 'CD':
-                f['properties']['STATEFP'] = statefp
-
-            if 'id' in f:
-                del f['id']
-            f['properties']['loa_key'] = loa_key
-
-            bboxes[loa_key] = shape(f['geometry']).bounds
-            geojson.append(f)
+        keys, cat = None, None
 
     if not os.path.exists('gen/tile_data/{}'.format(LOA)):
         os.makedirs('gen/tile_data/{}'.format(LOA))
-    with open('gen/tile_data/{}/{}.geojson'.format(LOA, key), 'w') as f:
-        # Write one feature per line, so tippecanoe can process in parallel
-        f.write('\n'.join(json.dumps(feat) for feat in geojson))
 
+    # Write one feature per line, so tippecanoe can process in parallel.
+    # Features are written as they're built, rather than held in memory
+    with NDJSONWriter('gen/tile_data/{}/{}.geojson'.format(LOA, key)) as geojson:
+        for f in tqdm(ref_geojson['features'], desc='Geojson for {}'.format(key)):
+            f, bbox = buildFeature(f, keys, cat)
+            bboxes[f['properties']['loa_key']] = bbox
+            geojson.write(f)
+
+        # Fill in leftover zctas
+        for f in tqdm(missing_feats, desc='Filling missing {}s'.format(LOA)):
+            f, bbox = buildFeature(f, keys, cat)
+            bboxes[f['properties']['loa_key']] = bbox
+            geojson.write(f)
+    profiler.rows(len(ref_geojson['features']) + len(missing_feats))
 
 
 print('Saving files...')
+profiler.start('writes')
 
 # Common to all LOA
 with open('gen/regions.json', 'w') as f:
@@ -532,37 +692,65 @@ with open('gen/regions.json', 'w') as f:
 with open('gen/schools.geojson', 'w') as f:
     json.dump(schools_geojson, f)
 
+with open('gen/school_ids.json', 'w') as f:
+    json.dump(schoolidx_to_featid, f)
+
+def writeSchools(schools_by_year):
+    """Write out schools' records, returning how many files changed"""
+    for id, school in schools_by_year.items():
+        school['id'] = id
+    if args.packed:
+        changed = []
+        writePacks('gen/schools', sorted(schools_by_year.items()), blockShard(SCHOOL_BLOCK_SIZE),
+                   write=lambda path, content: changed.append(manifest.writeIfChanged(path, content)))
+        return sum(changed)
+    n_written = 0
+    for id, school in schools_by_year.items():
+        n_written += manifest.writeIfChanged('gen/schools/{}.json'.format(id), json.dumps(school))
+    return n_written
+
 if not os.path.exists('gen/schools'):
     os.makedirs('gen/schools')
-for id, school in schools_by_year.items():
-    school['id'] = id
-    with open('gen/schools/{}.json'.format(id), 'w') as f:
-        json.dump(school, f)
+if args.stream:
+    n_written = 0
+    for _, spilled in school_spill.shards():
+        schools_by_year = defaultdict(dict)
+        for id, (y, record) in spilled:
+            schools_by_year[id][y] = record
+        n_written += writeSchools(schools_by_year)
+else:
+    n_written = writeSchools(schools_by_year)
+print('{} school files changed'.format(n_written))
 
 # LOA specific
 if not os.path.exists('gen/{}'.format(LOA)):
     os.makedirs('gen/{}'.format(LOA))
 
+# Let the frontend know how to find packed records
+if args.packed:
+    meta['packed'] = {
+        'prefix': LOA_PREFIX_LEN,
+        'schools': SCHOOL_BLOCK_SIZE
+    }
+
 with open('gen/{}/meta.json'.format(LOA), 'w') as f:
     json.dump(meta, f)
 
 bboxes_dir = 'gen/{}/bboxes'.format(LOA)
 if not os.path.exists(bboxes_dir):
     os.makedirs(bboxes_dir)
-for zip, bbox in bboxes.items():
-    with open('{}/{}.json'.format(bboxes_dir, zip), 'w') as f:
-        json.dump(bbox, f)
-
-loa_path = 'gen/{}/by_cat'.format(LOA)
-if not os.path.exists(loa_path):
-    os.makedirs(loa_path)
-for key, schools_by_loa in data_by_key_loa.items():
-    for loa_key, schools in schools_by_loa.items():
-        path = '{}/{}'.format(loa_path, key)
-        if not os.path.exists(path):
-            os.makedirs(path)
-        with open('{}/{}.json'.format(path, loa_key), 'w') as f:
-                json.dump(schools, f)
+if args.packed:
+    if bboxes:
+        writePacks(bboxes_dir, sorted(bboxes.items()), prefixShard(LOA_PREFIX_LEN))
+else:
+    for zip, bbox in bboxes.items():
+        with open('{}/{}.json'.format(bboxes_dir, zip), 'w') as f:
+            json.dump(bbox, f)
+if not tiles_fresh:
+    manifest.record('tile_data', tiles_fp, tile_paths)
+
+manifest.save()
+profiler.report()
 
 # with open('gen/{}/data.json'.format(LOA), 'w') as f:
 #     json.dump(data, f)
@@ -1,10 +1,25 @@
+import os
 import json
 import math
-import pandas as pd
+import shutil
+import argparse
+from operator import itemgetter
+from collections import defaultdict
+from profiling import Profiler
+from csvcache import readCSV
+from derive_tileset import deriveTileset, yearFilter
 
-state_lvl = pd.read_csv('src/factsheets/MSD_State_Lvl_02.03.21.csv')
-cd_lvl = pd.read_csv('src/factsheets/MSD_CD_Lvl_02.03.21.csv')
+parser = argparse.ArgumentParser()
+parser.add_argument('--shard', choices=['state', 'district'], default=None,
+                    help='Write factsheets to gen/factsheets/ as one file per state (by FIPS), or per state and district, with an index, instead of one gen/factsheets.json')
+args = parser.parse_args()
+
+profiler = Profiler('process_factsheets')
+profiler.start('ingest')
+state_lvl = readCSV('src/factsheets/MSD_State_Lvl_02.03.21.csv')
+cd_lvl = readCSV('src/factsheets/MSD_CD_Lvl_02.03.21.csv')
 dfs = [state_lvl, cd_lvl]
+profiler.rows(sum(len(df) for df in dfs))
 
 demographics = ['asian', 'black', 'latino', 'white']
 schema = {
@@ -406,84 +421,135 @@ schema = {
     }
 }
 
+profiler.start('factsheets')
+FIELDS = ['label', 'rank', 'change', 'nationalRank', 'stateRank']
+
+def compileSchema(schema, columns):
+    """Compile the schema once into the columns it reads and
+    a function that assembles a row's nested factsheet from
+    those columns' values. Columns missing from the data,
+    or given as None, are always None"""
+    needed, index = [], {}
+    def column(col):
+        if col is None or col not in columns:
+            return lambda row: None
+        if col not in index:
+            index[col] = len(needed)
+            needed.append(col)
+        return itemgetter(index[col])
+    def const(val):
+        return lambda row: val
+    def obj(fields):
+        return lambda row: {k: f(row) for k, f in fields}
+    def seq(fields):
+        return lambda row: [f(row) for f in fields]
+
+    categories = []
+    for category, scheme in schema.items():
+        groups = []
+        for group, keys in scheme.items():
+            fields = []
+            for key, cols in keys.items():
+                if 'demographics' in key:
+                    f = obj([(demo, seq([column(tmpl.format(demo.upper())) for tmpl in cols]))
+                             for demo in demographics])
+                else:
+                    f = obj([(k, column(cols[k])) for k in FIELDS if k in cols]
+                            + [('name', const(cols['name']))])
+                fields.append((key, f))
+            groups.append((group, obj(fields)))
+        categories.append((category, obj(groups)))
+    return needed, obj(categories)
+
+def buildFactsheets(df, keys):
+    """Factsheets for each row of `df`, by the corresponding key"""
+    columns, build = compileSchema(schema, set(df.columns))
+    vals = df[columns].astype(object)
+    rows = vals.where(vals.notnull(), None).to_numpy().tolist()
+    return {key: build(row) for key, row in zip(keys, rows)}
+
+def writeShards(data, shards, out='gen/factsheets'):
+    """Write factsheets grouped into their shard files, with an
+    index of region name -> shard file for the frontend to look up
+    which file to fetch"""
+    # Clear out shards from previous runs
+    if os.path.exists(out):
+        shutil.rmtree(out)
+    by_shard = defaultdict(dict)
+    for name, shard in shards.items():
+        by_shard[shard][name] = data[name]
+    for shard, sheets in by_shard.items():
+        path = '{}/{}.json'.format(out, shard)
+        dir = os.path.dirname(path)
+        if not os.path.exists(dir):
+            os.makedirs(dir)
+        with open(path, 'w') as f:
+            json.dump(sheets, f)
+    with open('{}/index.json'.format(out), 'w') as f:
+        json.dump({name: '{}.json'.format(shard) for name, shard in shards.items()}, f)
+
+# State name -> FIPS, so states and their
+# districts are sharded on the same key
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fipsToState.json')) as f:
+    state_fips = {name: fips for fips, name in json.load(f).items()}
+
+# For regions without a FIPS code (e.g. National)
+NATIONAL_SHARD = 'national'
+
 data = {}
+shards = {}
 for df in dfs:
-    for i, row in df.iterrows():
-        # state = row['State']
-        state = row['State_Name']
-        if 'CONG_DIST' in row:
-            state = '{}, District {}'.format(state, str(row['CONG_DIST'])[-2:])
-        data[state] = {}
-        for category, scheme in schema.items():
-            data[state][category] = {}
-            for group, keys in scheme.items():
-                data[state][category][group] = {}
-                for key, columns in keys.items():
-                    if 'demographics' in key:
-                        data[state][category][group][key] = {}
-                        for demo in demographics:
-                            data[state][category][group][key][demo] = []
-                            for col_tmpl in columns:
-                                column = col_tmpl.format(demo.upper())
-                                try:
-                                    val = row[column]
-                                except KeyError:
-                                    val = None
-                                if not isinstance(val, str) and (isinstance(val, (int, float)) and math.isnan(val)):
-                                    val = None
-                                data[state][category][group][key][demo].append(val)
-                    else:
-                        data[state][category][group][key] = {}
-                        for colkey in ['label', 'rank', 'change', 'nationalRank', 'stateRank']:
-                            if colkey not in columns: continue
-                            column = columns[colkey]
+    profiler.rows(len(df))
+    # names = df['State']
+    names = df['State_Name']
+    if args.shard:
+        shard = names.map(state_fips).fillna(NATIONAL_SHARD)
+    if 'CONG_DIST' in df.columns:
+        names = names + ', District ' + df['CONG_DIST'].astype(str).str[-2:]
+        if args.shard == 'district':
+            # Leading zeros are lost if read as ints
+            codes = df['CONG_DIST'].astype(str).str.zfill(4)
+            shard = shard.where(shard == NATIONAL_SHARD, shard + '/' + codes)
+    data.update(buildFactsheets(df, names))
+    if args.shard:
+        shards.update(zip(names, shard))
 
-                            if column is None:
-                                val = None
-                            else:
-                                try:
-                                    val = row[column]
-                                except KeyError:
-                                    val = None
-                            if val is None or isinstance(val, str) or not math.isnan(val):
-                                data[state][category][group][key][colkey] = val
-                            else:
-                                data[state][category][group][key][colkey] = None
-                        data[state][category][group][key]['name'] = columns['name']
+profiler.start('writes')
+if args.shard:
+    writeShards(data, shards)
 
+    # The frontend bundles this, so keep just what
+    # it shows first and fetch the rest by the index
+    data = {name: data[name] for name, shard in shards.items() if shard == NATIONAL_SHARD}
 with open('gen/factsheets.json', 'w') as f:
     json.dump(data, f)
 
 # Create the tileset
+profiler.start('tileset')
 # Can drop years except 2019, since that's all we use in the comparison map,
 # then add in additional data
 props = ['MED_INC_pch_0919', 'MED_BAL_pch_0919']
 territory_fips = ['60', '66', '69', '72', '78']
-cd_lvl.set_index('CONG_DIST', inplace=True)
-vals = {}
-with open('gen/tile_data/CD/ALL.geojson', 'r') as f:
-    geojson = []
-    for l in f.readlines():
-        feat = json.loads(l)
-        to_delete = [k for k in feat['properties'].keys() if 'Y:' in k and not k.endswith('Y:2019')]
-        for k in to_delete:
-            del feat['properties'][k]
+cd_rows = dict(zip(cd_lvl['CONG_DIST'], cd_lvl[props].to_dict('records')))
+vals = defaultdict(list)
 
-        # If ends with ZZ, then its a body of water
-        district = feat['properties']['loa_key']
-        if district.endswith('ZZ') or any(district.startswith(c) for c in territory_fips):
-            pass
-        else:
-            data = cd_lvl.loc[district]
-            for k in props:
-                feat['properties']['{}.Y:2019'.format(k)] = data[k]
-                if k not in vals:
-                    vals[k] = []
-                vals[k].append(data[k])
-        geojson.append(feat)
+def addComparisons(feat):
+    # If ends with ZZ, then its a body of water
+    district = feat['properties']['loa_key']
+    if district.endswith('ZZ') or district[:2] in territory_fips:
+        return
+    data = cd_rows[district]
+    for k in props:
+        # Missing values are written as null and left out of the ranges
+        # (json would write NaN, and min/max with NaN depend on order)
+        val = None if math.isnan(data[k]) else data[k]
+        feat['properties']['{}.Y:2019'.format(k)] = val
+        if val is not None:
+            vals[k].append(val)
 
-with open('gen/tile_data/CD/COMPARISONS.geojson', 'w') as f:
-    f.write('\n'.join([json.dumps(feat) for feat in geojson]))
+n = deriveTileset('gen/tile_data/CD/ALL.geojson', 'gen/tile_data/CD/COMPARISONS.geojson',
+                  keep=yearFilter([2019]), transform=addComparisons)
+profiler.rows(n)
 
 # Update existing meta
 with open('gen/CD/meta.json', 'r') as f:
@@ -495,4 +561,6 @@ for k in props:
     meta['ranges'][k] = (mn, mx)
     meta['min']['{}.Y:2019'.format(k)] = mn
 with open('gen/CD/meta.json', 'w') as f:
-    json.dump(meta, f)
\ No newline at end of file
+    json.dump(meta, f)
+
+profiler.report()
\ No newline at end of file
@@ -1,8 +1,8 @@
 import json
 import math
-import pandas as pd
+from csvcache import readCSV
 
-df = pd.read_csv('src/factsheets/MSD_State_Lvl_12.14.2020.csv')
+df = readCSV('src/factsheets/MSD_State_Lvl_12.14.2020.csv')
 groups = {
     'median': {
         'income': {
@@ -1,7 +1,7 @@
 import json
-import pandas as pd
+from csvcache import readCSV
 
-df = pd.read_csv('src/2016.45min.StateLevelData.csv')
+df = readCSV('src/2016.45min.StateLevelData.csv')
 
 scis = {}
 enrollments = {}
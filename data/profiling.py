@@ -0,0 +1,204 @@
+"""Per-stage timing for the data scripts.
+
+Each script names its stages (ingest, zones, geometry, writes, ...)
+and this records wall time, CPU time (including any worker processes),
+peak RSS and rows/sec for each. A report is written per run to
+`gen/profile/{script}/{timestamp}.json` (and `.html`), so builds
+can be compared over time.
+
+Set `CPROFILE` to a comma-separated list of stage names
+(or `all`) to also run those stages under cProfile; stats are
+saved next to the report as `{timestamp}.{stage}.prof`.
+"""
+
+import os
+import io
+import sys
+import json
+import html
+import time
+import pstats
+import cProfile
+import resource
+from datetime import datetime
+from contextlib import contextmanager
+
+REPORT_DIR = 'gen/profile'
+
+
+def cpuTime():
+    """CPU time of this process and its finished child processes"""
+    self = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return self.ru_utime + self.ru_stime + children.ru_utime + children.ru_stime
+
+def peakRSS():
+    """Peak resident set size so far, in MB, of this
+    process or the largest of its finished child processes"""
+    # ru_maxrss is in KB on Linux, bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    self = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(self, children) * scale / 1e6
+
+
+class Profiler:
+    def __init__(self, script, report_dir=REPORT_DIR):
+        self.script = script
+        self.report_dir = '{}/{}'.format(report_dir, script)
+        self.started = datetime.now()
+        self.run_id = self.started.strftime('%Y%m%d-%H%M%S')
+        self.stages = []
+        self._current = None
+
+        profiled = os.environ.get('CPROFILE', '')
+        self.profiled = {s.strip() for s in profiled.split(',') if s.strip()}
+
+    def start(self, name):
+        """Start timing a stage, ending the current one if any"""
+        self.stop()
+        prof = None
+        if 'all' in self.profiled or name in self.profiled:
+            prof = cProfile.Profile()
+            prof.enable()
+        self._current = {
+            'name': name,
+            'rows': None,
+            '_wall': time.perf_counter(),
+            '_cpu': cpuTime(),
+            '_prof': prof,
+        }
+
+    def rows(self, n):
+        """Add to the number of rows the current stage processed"""
+        if self._current is not None:
+            self._current['rows'] = (self._current['rows'] or 0) + n
+
+    def stop(self, rows=None):
+        """End the current stage, if any"""
+        cur = self._current
+        if cur is None:
+            return
+        self._current = None
+        if rows is not None:
+            cur['rows'] = (cur['rows'] or 0) + rows
+
+        prof = cur.pop('_prof')
+        if prof is not None:
+            prof.disable()
+        wall = time.perf_counter() - cur.pop('_wall')
+        cpu = cpuTime() - cur.pop('_cpu')
+        cur.update({
+            'wall': wall,
+            'cpu': cpu,
+            'peak_rss_mb': peakRSS(),
+            'rows_per_sec': cur['rows']/wall if cur['rows'] and wall else None,
+        })
+        if prof is not None:
+            cur['profile'] = self._saveProfile(cur['name'], prof)
+        self.stages.append(cur)
+
+    @contextmanager
+    def stage(self, name, rows=None):
+        self.start(name)
+        try:
+            yield self
+        finally:
+            self.stop(rows=rows)
+
+    def _saveProfile(self, name, prof):
+        self._makeDir()
+        name = name.replace(' ', '_')
+        runs = sum(1 for s in self.stages if s['name'].replace(' ', '_') == name)
+        if runs:
+            name = '{}.{}'.format(name, runs)
+        path = '{}/{}.{}.prof'.format(self.report_dir, self.run_id, name)
+        prof.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats('cumulative').print_stats(20)
+        return {'path': path, 'top': out.getvalue()}
+
+    def _makeDir(self):
+        if not os.path.exists(self.report_dir):
+            os.makedirs(self.report_dir)
+
+    def summary(self):
+        """Stages aggregated by name (e.g. a stage
+        run once per year), in the order first run"""
+        totals = {}
+        for s in self.stages:
+            t = totals.setdefault(s['name'], {
+                'name': s['name'], 'calls': 0, 'wall': 0, 'cpu': 0,
+                'peak_rss_mb': 0, 'rows': None})
+            t['calls'] += 1
+            t['wall'] += s['wall']
+            t['cpu'] += s['cpu']
+            t['peak_rss_mb'] = max(t['peak_rss_mb'], s['peak_rss_mb'])
+            if s['rows'] is not None:
+                t['rows'] = (t['rows'] or 0) + s['rows']
+        for t in totals.values():
+            t['rows_per_sec'] = t['rows']/t['wall'] if t['rows'] and t['wall'] else None
+        return list(totals.values())
+
+    def report(self):
+        """Print the stage summary and write the JSON and HTML reports"""
+        self.stop()
+        summary = self.summary()
+        total = sum(s['wall'] for s in summary)
+        print('{:<24} {:>9} {:>9} {:>10} {:>12}'.format('Stage', 'Wall (s)', 'CPU (s)', 'RSS (MB)', 'Rows/s'))
+        for s in summary:
+            print('{:<24} {:>9.1f} {:>9.1f} {:>10.0f} {:>12}'.format(
+                s['name'], s['wall'], s['cpu'], s['peak_rss_mb'],
+                '{:.0f}'.format(s['rows_per_sec']) if s['rows_per_sec'] else '-'))
+        print('{:<24} {:>9.1f}'.format('Total', total))
+
+        self._makeDir()
+        report = {
+            'script': self.script,
+            'args': sys.argv[1:],
+            'started': self.started.isoformat(),
+            'wall': total,
+            'peak_rss_mb': peakRSS(),
+            'summary': summary,
+            'stages': self.stages,
+        }
+        path = '{}/{}'.format(self.report_dir, self.run_id)
+        with open('{}.json'.format(path), 'w') as f:
+            json.dump(report, f, indent=2)
+        with open('{}.html'.format(path), 'w') as f:
+            f.write(renderHTML(report))
+        return report
+
+
+def renderHTML(report):
+    total = report['wall'] or 1
+    rows = []
+    for s in report['summary']:
+        rows.append(
+            '<tr><td>{name}</td><td>{calls}</td><td>{wall:.2f}</td><td>{cpu:.2f}</td>'
+            '<td>{rss:.0f}</td><td>{rows}</td><td>{rate}</td>'
+            '<td><div style="background:#4a90d9;height:1em;width:{pct:.1f}%"></div></td></tr>'.format(
+                name=s['name'], calls=s['calls'], wall=s['wall'], cpu=s['cpu'],
+                rss=s['peak_rss_mb'], rows=s['rows'] if s['rows'] is not None else '-',
+                rate='{:.0f}'.format(s['rows_per_sec']) if s['rows_per_sec'] else '-',
+                pct=100*s['wall']/total))
+    profiles = ''.join(
+        '<h2>{}</h2><pre>{}</pre>'.format(html.escape(s['name']), html.escape(s['profile']['top']))
+        for s in report['stages'] if 'profile' in s)
+    return '''<!doctype html>
+<html>
+<head><meta charset="utf-8"><title>{script} {started}</title>
+<style>body{{font-family:sans-serif}} td,th{{padding:2px 8px;text-align:right}} td:first-child{{text-align:left}} td:last-child{{width:300px}}</style>
+</head>
+<body>
+<h1>{script}</h1>
+<p>{started} &middot; args: {args} &middot; {wall:.1f}s &middot; peak RSS {rss:.0f}MB</p>
+<table>
+<tr><th>Stage</th><th>Calls</th><th>Wall (s)</th><th>CPU (s)</th><th>Peak RSS (MB)</th><th>Rows</th><th>Rows/s</th><th></th></tr>
+{rows}
+</table>
+{profiles}
+</body>
+</html>'''.format(
+        script=report['script'], started=report['started'], args=' '.join(report['args']) or '-',
+        wall=report['wall'], rss=report['peak_rss_mb'], rows='\n'.join(rows), profiles=profiles)
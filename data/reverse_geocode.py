@@ -1,51 +1,79 @@
 import json
-import requests
-import pandas as pd
-from tqdm import tqdm
+import argparse
+from csvcache import readCSV
 from config import GOOGLE_PLACES_API_KEY
+from offline_geocoding import Gazetteer
+from geocoding import GEOCODE_URL, GeocodeCache, GeocodeClient, coordKey, reverseGeocode
 
-def reverse_geocode(lat, lng):
-    url = 'https://maps.googleapis.com/maps/api/geocode/json'
-    params = {
-        'key': GOOGLE_PLACES_API_KEY,
-        'latlng': '{},{}'.format(lat, lng),
-    }
-    resp = requests.get(url, params=params)
-    data = resp.json()
-    results = []
-    for res in data['results']:
-        addr = {c['types'][0]: c['short_name'] for c in res['address_components']}
-        results.append(addr)
-    return results
+# Which geocoder to use, and address points
+# to add to the gazetteer for the offline one
+try:
+    from config import GEOCODER
+except ImportError:
+    GEOCODER = 'google'
+try:
+    from config import GAZETTEER_ADDRESSES
+except ImportError:
+    GAZETTEER_ADDRESSES = None
+
+def bestAddress(results):
+    """Kinda hacky, try to get best info"""
+    try:
+        res = next(res for res in results if 'street_number' in res)
+    except StopIteration:
+        try:
+            res = next(res for res in results if 'route' in res)
+        except StopIteration:
+            # No street at all (e.g. the offline geocoder without
+            # address points), so fall back to the ZIP
+            try:
+                res = next(res for res in results if 'postal_code' in res)
+            except StopIteration:
+                return None
+            return 'ZIP {}*'.format(res['postal_code'])
+
+    # Mark * to indicate reverse geocoded
+    if 'street_number' in res:
+        return '{} {}*'.format(res['street_number'], res['route'])
+    else:
+        return '{}*'.format(res['route'])
 
 if __name__ == '__main__':
-    all_years = pd.read_csv('src/master_08.06.2020.csv',
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--geocoder', choices=['google', 'offline'], default=GEOCODER, help='Geocode with the Google API, or offline with the gazetteer')
+    parser.add_argument('--addresses', default=GAZETTEER_ADDRESSES, help='CSV of address points for the offline geocoder (LATITUDE, LONGITUDE and address component columns)')
+    parser.add_argument('--max-km', type=float, default=None, help='For the offline geocoder, ignore address points further than this')
+    parser.add_argument('--geocode-url', default=GEOCODE_URL, help='Geocoding endpoint (e.g. a local stub for testing)')
+    parser.add_argument('--qps', type=float, default=10, help='Maximum geocoding requests per second')
+    parser.add_argument('--workers', type=int, default=8, help='Number of concurrent geocoding requests')
+    args = parser.parse_args()
+
+    all_years = readCSV('src/master_08.06.2020.csv',
             encoding='ISO-8859-1',
             dtype={'YEAR': str, 'ZIP': str})
 
+    # Each distinct coordinate is only looked up once
     rows = all_years[all_years['ADDR'].isnull()]
+    located = rows.dropna(subset=['LATITUDE', 'LONGITUD'])
+    coords = list(dict.fromkeys(zip(located['LATITUDE'].tolist(), located['LONGITUD'].tolist())))
+    if args.geocoder == 'offline':
+        results = Gazetteer(addresses=args.addresses, max_km=args.max_km).reverse(coords)
+    else:
+        cache = GeocodeCache('gen/cached_reverse_geocode.json')
+        client = GeocodeClient(GOOGLE_PLACES_API_KEY, url=args.geocode_url, qps=args.qps, workers=args.workers)
+        results = reverseGeocode(client, cache, coords)
+        cache.compact()
+
     lookup = {}
-    for idx, row in tqdm(rows.iterrows(), total=len(rows)):
-        lat = row.LATITUDE
-        lng = row.LONGITUD
-        results = reverse_geocode(lat, lng)
+    for coord, res in zip(coords, results):
+        addr = bestAddress(res)
+        if addr is None:
+            print('No address found for:', coordKey(*coord))
+            continue
+        lookup[coordKey(*coord)] = addr
 
-        # Kinda hacky, try to get best info
-        try:
-            res = next(res for res in results if 'street_number' in res)
-        except StopIteration:
-            try:
-                res = next(res for res in results if 'route' in res)
-            except StopIteration:
-                res = results[0]
-
-        # Mark * to indicate reverse geocoded
-        if 'street_number' in res:
-            addr = '{} {}*'.format(res['street_number'], res['route'])
-        else:
-            addr = '{}*'.format(res['route'])
-        all_years.loc[idx, 'ADDR'] = addr
-        lookup['{},{}'.format(lat, lng)] = addr
+    keys = [coordKey(lat, lng) for lat, lng in zip(rows['LATITUDE'].tolist(), rows['LONGITUD'].tolist())]
+    all_years.loc[rows.index, 'ADDR'] = [lookup.get(k) for k in keys]
     all_years.to_csv('gen/master_08.06.2020.reverse_geocoded.csv', index=False)
     with open('gen/reverse_geocode_lookup.json', 'w') as f:
-        json.dump(lookup, f)
\ No newline at end of file
+        json.dump(lookup, f)
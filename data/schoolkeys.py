@@ -0,0 +1,46 @@
+"""Matches schools in the school zone files to their feature ids.
+
+Zone files identify schools by their raw (UNITID, ADDR, MAPNAME),
+which needs ftfy to undo encoding issues (double encoded utf8, I believe)
+before it matches the master school list. The same few thousand schools
+repeat across millions of zone rows, so each unique tuple is fixed
+just once and zone rows are matched against the index with a merge.
+"""
+
+import numpy as np
+import pandas as pd
+from textfix import fixText
+
+KEY_COLS = ['UNITID', 'ADDR', 'MAPNAME']
+
+
+def schoolKey(vals, fix=str):
+    return '__'.join(fix(str(v)) if v is not None else 'nan' for v in vals)
+
+
+class SchoolKeyIndex:
+    def __init__(self, featids, fix=fixText):
+        self.featids = featids
+        self.fix = fix
+        self.table = None
+
+    def add(self, df):
+        """Index any (UNITID, ADDR, MAPNAME)
+        tuples in `df` not seen yet"""
+        new = df[KEY_COLS].drop_duplicates()
+        if self.table is not None:
+            new = new.merge(self.table, on=KEY_COLS, how='left', indicator=True)
+            new = new.loc[new['_merge'] == 'left_only', KEY_COLS]
+        if new.empty: return
+        new = new.copy()
+
+        # Raises a KeyError for schools missing from the master list
+        new['id'] = [self.featids[schoolKey(vals, fix=self.fix)]
+                for vals in new.itertuples(index=False, name=None)]
+        self.table = pd.concat([self.table, new], ignore_index=True) if self.table is not None else new
+
+    def ids(self, df):
+        """Feature ids for each row of `df`"""
+        self.add(df)
+        ids = df[KEY_COLS].merge(self.table, on=KEY_COLS, how='left')['id']
+        return ids.to_numpy(dtype=np.int64)
@@ -0,0 +1,208 @@
+"""Key-indexed access to shapefile features.
+
+Scanning a national shapefile (e.g. all ZCTAs) to find a handful of
+features is slow, so this builds an index of feature key -> feature id
+(FID) once, caches it on disk next to the other generated files, and
+then reads only the requested features by FID.
+
+`ShapeLocator` goes the other way, finding which feature contains
+each of a batch of points. It reads just the features' bounding boxes
+up front and only parses the polygons whose boxes contain a point.
+"""
+
+import os
+import json
+import fiona
+import shapely
+import numpy as np
+from tqdm import tqdm
+from collections import OrderedDict
+from shapely.strtree import STRtree
+from shapely.geometry import Point, box, shape
+
+# Shapely 2 can query and test whole arrays of points at once
+VECTORIZED = hasattr(shapely, 'points')
+if VECTORIZED:
+    from shapely import contains_xy
+else:
+    from shapely.vectorized import contains as contains_xy
+
+
+def shapefileSignature(path):
+    """Changes whenever the shapefile's records or attributes do"""
+    base, _ = os.path.splitext(path)
+    sig = []
+    for ext in ['.shp', '.dbf']:
+        st = os.stat(base + ext)
+        sig.append([st.st_size, st.st_mtime_ns])
+    return sig
+
+def shapefileBounds(path):
+    """Bounding box (minx, miny, maxx, maxy) of each feature, by FID,
+    read from the record headers without parsing any geometry.
+    Features with no geometry get NaNs"""
+    base, _ = os.path.splitext(path)
+
+    # The index file gives each record's offset into the .shp,
+    # in 16-bit words, after a 100 byte header
+    shx = np.fromfile(base + '.shx', dtype='>i4', offset=100).reshape(-1, 2)
+    offsets = shx[:, 0].astype(np.int64) * 2
+
+    # Each record: 8 byte header, then the shape type and
+    # (for all but points and null shapes) its bounding box
+    shp = np.memmap(base + '.shp', dtype=np.uint8, mode='r')
+    # (clipped, since point and null records are shorter)
+    idx = np.minimum(offsets[:, None] + 8 + np.arange(36), len(shp) - 1)
+    recs = np.ascontiguousarray(shp[idx])
+    shape_types = recs[:, :4].view('<i4')[:, 0]
+    bounds = recs[:, 4:].view('<f8').astype(np.float64)
+
+    # Points only have their coordinates
+    points = np.isin(shape_types, [1, 11, 21])
+    bounds[points, 2:] = bounds[points, :2]
+    bounds[shape_types == 0] = np.nan
+    return bounds
+
+
+class ShapeIndex:
+    def __init__(self, path, key_field, cache_path=None):
+        self.path = path
+        self.key_field = key_field
+        self.cache_path = cache_path
+        self.collection = fiona.open(path)
+        self.index = self._loadIndex()
+
+    def _loadIndex(self):
+        sig = shapefileSignature(self.path)
+        if self.cache_path is not None:
+            try:
+                with open(self.cache_path) as f:
+                    cached = json.load(f)
+                if cached['signature'] == sig and cached['key_field'] == self.key_field:
+                    return cached['index']
+            except FileNotFoundError:
+                pass
+
+        # Only the attributes are needed for this
+        index = {}
+        attrs = fiona.open(self.path, ignore_geometry=True)
+        for fid, f in tqdm(attrs.items(), total=len(attrs),
+                           desc='Indexing {}'.format(os.path.basename(self.path))):
+            index[f['properties'][self.key_field]] = fid
+
+        if self.cache_path is not None:
+            dir = os.path.dirname(self.cache_path)
+            if dir and not os.path.exists(dir):
+                os.makedirs(dir)
+            with open(self.cache_path, 'w') as f:
+                json.dump({
+                    'signature': sig,
+                    'key_field': self.key_field,
+                    'index': index
+                }, f)
+        return index
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def get(self, key):
+        return self.collection[self.index[key]]
+
+    def features(self, keys):
+        """Fetch the features for the given keys, in file order;
+        keys that aren't in the shapefile are skipped"""
+        fids = sorted(self.index[k] for k in keys if k in self.index)
+        for fid in fids:
+            yield self.collection[fid]
+
+
+class GeometryTree:
+    """An STRtree whose queries give indices into `geoms` with any
+    version of shapely. Older versions return the geometries
+    themselves from queries, not indices"""
+    def __init__(self, geoms):
+        self.geoms = geoms
+        self.tree = STRtree(geoms)
+        if not VECTORIZED:
+            self._index = {id(geom): i for i, geom in enumerate(geoms)}
+
+    def query(self, geom):
+        """Indices of the geometries whose bounding boxes intersect `geom`.
+        With shapely 2, `geom` can also be an array of geometries, giving
+        (input index, tree index) pairs as `STRtree.query` does"""
+        hits = self.tree.query(geom)
+        if VECTORIZED:
+            return hits
+        return np.array([self._index[id(hit)] for hit in hits], dtype=np.int64)
+
+
+class ShapeLocator:
+    """Finds the feature containing each point. Candidates are narrowed
+    down with an STRtree of the features' bounding boxes, and only those
+    features' polygons are parsed, keeping up to `cache_size` of them"""
+    def __init__(self, path, key_field, cache_path=None, cache_size=4096):
+        self.index = ShapeIndex(path, key_field, cache_path=cache_path)
+        self.keys = {fid: key for key, fid in self.index.index.items()}
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        bounds = shapefileBounds(path)
+        self.fids = np.flatnonzero(~np.isnan(bounds).any(axis=1))
+        self.tree = GeometryTree([box(*bounds[fid]) for fid in self.fids])
+
+    def __len__(self):
+        return len(self.index)
+
+    def shape(self, fid):
+        """The parsed geometry of a feature, from the cache if possible"""
+        if fid in self.cache:
+            self.cache.move_to_end(fid)
+            return self.cache[fid]
+        shp = shape(self.index.collection[int(fid)]['geometry'])
+        self.cache[fid] = shp
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return shp
+
+    def _candidates(self, lats, lngs, valid):
+        """(point, FID) pairs where the feature's bounding box contains the point"""
+        if VECTORIZED:
+            pts, hits = self.tree.query(shapely.points(lngs[valid], lats[valid]))
+            return valid[pts], self.fids[hits]
+        pts, hits = [], []
+        for i in valid:
+            for hit in self.tree.query(Point(lngs[i], lats[i])):
+                pts.append(i)
+                hits.append(hit)
+        return np.array(pts, dtype=np.int64), self.fids[np.array(hits, dtype=np.int64)]
+
+    def locate(self, lats, lngs):
+        """FID of the feature containing each point,
+        or -1 if none does (or the point is missing)"""
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        found = np.full(len(lats), -1, dtype=np.int64)
+        valid = np.flatnonzero(np.isfinite(lats) & np.isfinite(lngs))
+        pts, fids = self._candidates(lats, lngs, valid)
+
+        # Test each candidate feature against all its points at once,
+        # in file order, so the first containing feature wins
+        order = np.lexsort((pts, fids))
+        pts, fids = pts[order], fids[order]
+        starts = np.flatnonzero(np.r_[True, fids[1:] != fids[:-1]]) if len(fids) else []
+        for start, end in zip(starts, np.r_[starts[1:], len(fids)]):
+            fid = fids[start]
+            idx = pts[start:end]
+            idx = idx[found[idx] < 0]
+            if not len(idx):
+                continue
+            inside = contains_xy(self.shape(fid), lngs[idx], lats[idx])
+            found[idx[inside]] = fid
+        return found
+
+    def keysFor(self, lats, lngs):
+        """Key of the feature containing each point, or None"""
+        return [self.keys.get(fid) if fid >= 0 else None for fid in self.locate(lats, lngs)]
@@ -0,0 +1,67 @@
+"""Summary statistics over area-level values.
+
+Values are kept in a single float64 array (LOAs x keys)
+with NaN for missing values, so each statistic is one
+vectorized reduction across every key at once.
+"""
+
+import warnings
+import numpy as np
+
+STATS = {
+    'min': np.nanmin,
+    'max': np.nanmax,
+    'mean': np.nanmean,
+    'median': np.nanmedian,
+}
+
+
+class KeyStats:
+    def __init__(self, keys, values):
+        self.keys = list(keys)
+        self.values = values
+        self.index = {k: i for i, k in enumerate(self.keys)}
+        self._computed = {}
+
+    @classmethod
+    def fromFrame(cls, df):
+        values = df.to_numpy(dtype=np.float64, na_value=np.nan)
+        return cls(df.columns, values)
+
+    def compute(self, stat):
+        """Compute a statistic for every key;
+        quantiles can be requested as e.g. 'q25'"""
+        if stat not in self._computed:
+            with warnings.catch_warnings():
+                # Keys with no values at all (e.g. a missing year)
+                # come out as NaN, which is fine
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                if stat.startswith('q'):
+                    q = float(stat[1:])/100
+                    result = np.nanquantile(self.values, q, axis=0)
+                else:
+                    result = STATS[stat](self.values, axis=0)
+            self._computed[stat] = result
+        return self._computed[stat]
+
+    def summary(self, stat, keys):
+        """Statistic for each key, or None if it has no values"""
+        result = self.compute(stat)
+        summary = {}
+        for key in keys:
+            try:
+                val = result[self.index[key]]
+            except KeyError:
+                val = np.nan
+            summary[key] = None if np.isnan(val) else float(val)
+        return summary
+
+    def range(self, keys):
+        """Min and max across all the given keys"""
+        idx = [self.index[k] for k in keys if k in self.index]
+        mins = self.compute('min')[idx]
+        maxs = self.compute('max')[idx]
+        mins, maxs = mins[~np.isnan(mins)], maxs[~np.isnan(maxs)]
+        if not mins.size:
+            return None, None
+        return float(mins.min()), float(maxs.max())
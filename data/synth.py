@@ -0,0 +1,414 @@
+"""Generates synthetic inputs for the build pipeline.
+
+The real `src/` inputs can't be shared, so this writes a stand-in tree
+of the same shape (same files, columns, key formats and quirks, e.g.
+double encoded addresses in the zone files and reverse geocoded
+addresses for schools missing one) at a configurable number of ZCTAs,
+for benchmarking the `data/` scripts offline:
+
+    python synth.py bench/10000 --loas 10000
+
+LOA shapes are a grid of boxes. Schools mostly sit inside their ZIP's
+ZCTA, but some are placed in a neighbouring one, so `check_coords.py`
+has to geocode them (offline, see the generated `config.py`). Their
+zones cover nearby ZCTAs, more of them for longer isochrones.
+"""
+
+import os
+import json
+import argparse
+import numpy as np
+import pandas as pd
+import fiona
+from shapely.geometry import box, mapping, MultiPolygon
+
+YEARS = [str(y) for y in range(2009, 2020)]
+ISOCHRONES = {'30min': 5, '45min': 10, '60min': 20} # isochrone -> LOAs per school
+SCHOOL_TYPES = ['allschools', 'con_1', 'con_2', 'con_3', 'lev_1', 'lev_2', 'lev_3']
+SCHOOL_FIELDS = ['SCI', 'AVGNP', 'n', 'AVGTF', 'ENROLLED']
+
+# Present in the real CSVs but unused, so they're
+# generated too, to keep parsing costs realistic
+UNUSED_FIELDS = ['AVGCINSON', 'AVGCINSOFF', 'AVGCINSFAM', 'AVGNPI30']
+
+ZCTA_FIELDS = ['MEDIANINCOME', 'STU_TOT_BAL', 'SINGLEZCTAPOP', 'ZCTAZONEPOP']
+CD_FIELDS = ['MEDIANINCOME', 'STU_TOT_BAL', 'CDPOP']
+DEMOGRAPHICS = ['', '_ASIAN', '_BLACK', '_LATINO', '_WHITE']
+FIPS = json.load(open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fipsToState.json')))
+GRID_ORIGIN = (-100, 30)
+MISSING_RATE = 0.1
+MISPLACED_RATE = 0.03 # schools with coordinates outside their ZIP's ZCTA
+CD_ZONES = 2 # districts per school
+
+
+def makeDirs(root, *dirs):
+    for d in dirs:
+        path = os.path.join(root, d)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+def grid(n, size):
+    """Boxes for `n` cells, in rows of `side`"""
+    side = int(np.ceil(np.sqrt(n)))
+    x0, y0 = GRID_ORIGIN
+    xs = x0 + (np.arange(n) % side) * size
+    ys = y0 + (np.arange(n) // side) * size
+    return [box(x, y, x + size, y + size) for x, y in zip(xs, ys)], side
+
+def values(rng, n, scale, missing=MISSING_RATE, decimals=2):
+    vals = np.round(rng.random(n) * scale, decimals)
+    vals[rng.random(n) < missing] = np.nan
+    return vals
+
+def counts(rng, n, lo, hi, missing=MISSING_RATE):
+    vals = rng.integers(lo, hi, n).astype(float)
+    vals[rng.random(n) < missing] = np.nan
+    return vals
+
+def areaTable(rng, loa_field, loas, fields):
+    """One row per LOA per year, like ZipLevel.*.csv or CD_Level.*.csv"""
+    n = len(loas)
+    df = pd.DataFrame({
+        loa_field: np.tile(loas.astype(int), len(YEARS)),
+        'YEAR': np.repeat([int(y) for y in YEARS], n),
+    })
+    m = len(df)
+    cols = {}
+    for k in SCHOOL_FIELDS + UNUSED_FIELDS:
+        for s in SCHOOL_TYPES:
+            if k == 'n':
+                vals = counts(rng, m, 0, 50)
+            else:
+                vals = values(rng, m, 10000)
+            cols['{}_{}'.format(k, s)] = vals
+    for k in fields:
+        cols[k] = values(rng, m, 50000, missing=MISSING_RATE/2, decimals=1)
+    df = pd.concat([df, pd.DataFrame(cols)], axis=1)
+
+    # Rows without an LOA show up in the real data
+    blank = pd.DataFrame({loa_field: [np.nan]*len(YEARS), 'YEAR': [int(y) for y in YEARS]})
+    return pd.concat([df, blank], ignore_index=True)
+
+def writeShapes(path, schema, feats):
+    with fiona.open(path, 'w', driver='ESRI Shapefile', schema=schema, crs='EPSG:4326') as f:
+        f.writerecords(feats)
+
+def writeGeoJSON(path, feats):
+    with open(path, 'w') as f:
+        json.dump({'type': 'FeatureCollection', 'features': feats}, f)
+
+
+def genZCTAs(root, rng, n):
+    spacing = max(1, 100000//n)
+    zctas = np.array([str(i*spacing).zfill(5) for i in range(n)])
+    size = min(0.1, 20/np.ceil(np.sqrt(n)))
+    geoms, side = grid(n, size)
+
+    for i in ISOCHRONES:
+        areaTable(rng, 'ZCTA', zctas, ZCTA_FIELDS).to_csv(
+            os.path.join(root, 'src/zips/ZipLevel.{}.csv'.format(i)), index=False)
+
+    # The reference geojson is missing some ZCTAs,
+    # which are filled in from the shapefile
+    feats = [{'type': 'Feature', 'id': j, 'properties': {'ZCTA5CE10': z}, 'geometry': mapping(g)}
+             for j, (z, g) in enumerate(zip(zctas, geoms)) if j % 10 != 3]
+    writeGeoJSON(os.path.join(root, 'src/zipcodes.geojson'), feats)
+    writeShapes(os.path.join(root, 'src/zctas/tl_2017_us_zcta510.shp'),
+        {'geometry': 'Polygon', 'properties': {'ZCTA5CE10': 'str'}},
+        ({'geometry': mapping(g), 'properties': {'ZCTA5CE10': z}} for z, g in zip(zctas, geoms)))
+    return zctas, geoms, side
+
+def genSchools(root, rng, zctas, geoms, n):
+    """Master school list, with a row per school per year it's open"""
+    home = rng.integers(0, len(zctas), n)
+    size = geoms[0].bounds[2] - geoms[0].bounds[0]
+
+    # Some schools' coordinates are in the next ZCTA over
+    located = home.copy()
+    misplaced = rng.random(n) < MISPLACED_RATE
+    located[misplaced] = (home[misplaced] + 1) % len(zctas)
+    centers = np.array([geoms[h].centroid.coords[0] for h in located])
+    centers += (rng.random((n, 2)) - 0.5) * size * 0.8
+    ids = 100000 + np.arange(n)
+    addrs = np.array(['{} Main St'.format(u) + ('é' if u % 5 == 0 else '') for u in range(n)], dtype=object)
+
+    # Addresses that had to be reverse geocoded
+    reverse = rng.random(n) < 0.05
+    addrs[reverse] = ['{} Rev St*'.format(u) for u in np.flatnonzero(reverse)]
+
+    open_years = rng.random((n, len(YEARS))) < 0.9
+    open_years[np.arange(n), rng.integers(0, len(YEARS), n)] = True
+    s_idx, y_idx = np.nonzero(open_years)
+    zips = zctas[home[s_idx]].astype(object)
+    plus4 = s_idx % 3 == 0
+    zips[plus4] = [z + '-1234' for z in zips[plus4]]
+    m = len(s_idx)
+    df = pd.DataFrame({
+        'YEAR': np.array(YEARS)[y_idx],
+        'UNITID': ids[s_idx],
+        'ADDR': addrs[s_idx],
+        'MAPNAME': ['School {}'.format(u) for u in s_idx],
+        'INSTNM': ['Institution {}'.format(u) for u in s_idx],
+        'ICLEVEL': rng.integers(1, 4, m),
+        'CONTROL': rng.integers(1, 4, m),
+        'UNDUPUG': counts(rng, m, 10, 20000),
+        'ENROLLED': counts(rng, m, 10, 20000),
+        'AVGNETPRICE': values(rng, m, 30000),
+        'TUFEYR3': values(rng, m, 50000),
+        'ZIP': zips,
+        'LATITUDE': np.round(centers[s_idx, 1], 6),
+        'LONGITUD': np.round(centers[s_idx, 0], 6),
+        'CITY': 'City',
+        'STABBR': 'NY',
+    })
+    df.to_csv(os.path.join(root, 'src/Master_SchoolList.csv'), index=False, encoding='ISO-8859-1')
+
+    # Include ZIP+4s, so check_coords.py finds every school's ZCTA
+    zip_codes = sorted(set(zctas) | set(zips))
+    pd.DataFrame({'ZIP_CODE': zip_codes, 'ZCTA': [z.split('-')[0] for z in zip_codes]}).to_csv(
+        os.path.join(root, 'src/zip_to_zcta_2018.csv'), index=False)
+
+    rev = df[df['ADDR'].str.endswith('*')]
+    lookup = {'{},{}'.format(lat, lng): addr for lat, lng, addr in zip(rev['LATITUDE'], rev['LONGITUD'], rev['ADDR'])}
+    with open(os.path.join(root, 'gen/reverse_geocode_lookup.json'), 'w') as f:
+        json.dump(lookup, f)
+
+    # The list before reverse geocoding, for reverse_geocode.py, with
+    # address points (for the offline geocoder) that give back the same lookup
+    df.assign(ADDR=df['ADDR'].mask(df['ADDR'].str.endswith('*'))).to_csv(
+        os.path.join(root, 'src/master_08.06.2020.csv'), index=False, encoding='ISO-8859-1')
+    rev = rev.drop_duplicates('UNITID')
+    pd.DataFrame({
+        'LATITUDE': rev['LATITUDE'],
+        'LONGITUDE': rev['LONGITUD'],
+        'street_number': rev['ADDR'].str.split().str[0],
+        'route': 'Rev St',
+        'postal_code': rev['ZIP'].str[:5],
+    }).to_csv(os.path.join(root, 'src/addresses.csv'), index=False)
+    return df, home
+
+def zoneRows(rng, schools, home, side, n_loas, k):
+    """k LOAs near each school's home LOA"""
+    r = int(np.ceil(np.sqrt(k)))
+    offsets = np.array([(dx, dy) for dx in range(-r, r+1) for dy in range(-r, r+1)])
+    pick = np.argsort(rng.random((len(schools), len(offsets))), axis=1)[:, :k]
+    h = home[schools]
+    x = np.clip((h % side)[:, None] + offsets[pick, 0], 0, side-1)
+    y = (h // side)[:, None] + offsets[pick, 1]
+    loas = np.clip(y * side + x, 0, n_loas-1)
+    return np.repeat(np.arange(len(schools)), k), loas.ravel()
+
+def zoneTable(rng, year_df, rows, loa_field, loa_keys, loas):
+    rows = year_df.iloc[rows]
+    # Zone files double encode non-ascii characters,
+    # and leave out reverse geocoded addresses
+    addrs = rows['ADDR'].str.encode('utf8').str.decode('latin1').to_numpy(dtype=object)
+    addrs[rows['ADDR'].str.endswith('*').to_numpy()] = None
+    return pd.DataFrame({
+        loa_field: loa_keys[loas].astype(int),
+        'UNITID': rows['UNITID'].to_numpy(),
+        'ADDR': addrs,
+        'MAPNAME': rows['MAPNAME'].to_numpy(),
+        'INSTNM': rows['INSTNM'].to_numpy(),
+        'LATITUDE': rows['LATITUDE'].to_numpy(),
+        'LONGITUD': rows['LONGITUD'].to_numpy(),
+        'DISTANCE': np.round(rng.random(len(loas)) * 60, 2),
+    })
+
+def genZones(root, rng, schools, home, zctas, side):
+    n_rows = 0
+    school_idx = {u: j for j, u in enumerate(sorted(schools['UNITID'].unique()))}
+    for y, year_df in schools.groupby('YEAR'):
+        year_df = year_df.reset_index(drop=True)
+        year_home = home[year_df['UNITID'].map(school_idx).to_numpy()]
+        for i, k in ISOCHRONES.items():
+            rows, loas = zoneRows(rng, np.arange(len(year_df)), year_home, side, len(zctas), k)
+            df = zoneTable(rng, year_df, rows, 'ZCTA5CE10', zctas, loas)
+            n_rows += len(df)
+            df.to_csv(os.path.join(root, 'src/school_zones/{}.{}.Schoolzones.SCI.csv'.format(y, i)),
+                      index=False, encoding='ISO-8859-1')
+    return n_rows
+
+def genCDs(root, rng, schools, n):
+    """Congressional districts, spread across states, plus one
+    water-only ('ZZ') district per state as in the real shapes"""
+    states = sorted(FIPS.keys())
+    per_state = max(1, int(np.ceil(n/len(states))))
+    cds = np.array(['{}{}'.format(st, str(d).zfill(2)) for st in states for d in range(1, per_state+1)][:n])
+    water = ['{}ZZ'.format(st) for st in sorted({cd[:2] for cd in cds})]
+    geoms, side = grid(len(cds) + len(water), 0.5)
+    geoms = dict(zip(list(cds) + water, geoms))
+
+    areaTable(rng, 'CONG_DIST', cds, CD_FIELDS).to_csv(
+        os.path.join(root, 'src/congressional_districts/CD_Level.45min.csv'), index=False)
+
+    for y, year_df in schools.groupby('YEAR'):
+        year_df = year_df.reset_index(drop=True)
+        rows = np.repeat(np.arange(len(year_df)), CD_ZONES)
+        loas = rng.integers(0, len(cds), len(rows))
+        zoneTable(rng, year_df, rows, 'CONG_DIST', cds, loas).to_csv(
+            os.path.join(root, 'src/congressional_districts/zones/{}.45min.Schoolzones.CD.csv'.format(y)),
+            index=False, encoding='ISO-8859-1')
+
+    feats = [{'type': 'Feature', 'id': j, 'properties': {'GEOID': cd, 'STATEFP': cd[:2]}, 'geometry': mapping(g)}
+             for j, (cd, g) in enumerate(geoms.items()) if j % 7 != 2]
+    writeGeoJSON(os.path.join(root, 'src/congressional_districts/shapes/cds.geojson'), feats)
+    writeShapes(os.path.join(root, 'src/congressional_districts/shapes/tl_2018_us_cd116.shp'),
+        {'geometry': 'Polygon', 'properties': {'GEOID': 'str', 'STATEFP': 'str'}},
+        ({'geometry': mapping(g), 'properties': {'GEOID': cd, 'STATEFP': cd[:2]}} for cd, g in geoms.items()))
+
+    # Lakes over some of the Wisconsin and Michigan districts
+    lakes = [g.centroid.buffer(0.2) for cd, g in geoms.items() if cd[:2] in ('26', '55')]
+    lakes += [box(-60, 10, -59, 11)]
+    writeShapes(os.path.join(root, 'src/lakes/ne_10m_lakes.shp'),
+        {'geometry': 'Polygon', 'properties': {'name': 'str'}},
+        ({'geometry': mapping(g), 'properties': {'name': 'Lake {}'.format(j)}} for j, g in enumerate(lakes)))
+    return cds, water, len(schools) * CD_ZONES
+
+def genFactsheets(root, rng, cds, water):
+    def columns(n):
+        cols = {}
+        for base in ['AVG_BAL_19', 'AVG_BAL_pch_0919', 'MED_BAL_19', 'MED_BAL_pch_0919',
+                     'MED_DEBT_INC_19', 'MED_DEBT_INC_pch_0919', 'MED_INC_19', 'MED_INC_pch_0919']:
+            for demo in DEMOGRAPHICS:
+                cols['{}{}'.format(base, demo)] = values(rng, n, 100)
+                cols['{}{}_Label'.format(base, demo)] = ['${:,.0f}'.format(v) for v in rng.random(n)*50000]
+                cols['{}{}_NatRank'.format(base, demo)] = rng.integers(1, 436, n)
+                cols['{}{}_StateRank'.format(base, demo)] = rng.integers(1, 53, n)
+        for k in ['rawcount', 'enrolled', 'AVGTF', 'AVGCINSOFF', 'AVGNP', 'SCI']:
+            for s in SCHOOL_TYPES:
+                cols['{}_{}'.format(k, s)] = values(rng, n, 10000)
+                cols['{}_{}_Label'.format(k, s)] = ['{:,.0f}'.format(v) for v in rng.random(n)*10000]
+                cols['{}_{}_NatRank'.format(k, s)] = rng.integers(1, 436, n)
+                cols['{}_{}_StateRank'.format(k, s)] = rng.integers(1, 53, n)
+                cols['{}_{}_pch_Label'.format(k, s)] = ['{:.1f}%'.format(v) for v in rng.random(n)*100]
+        return pd.DataFrame(cols)
+
+    # Plus a national row, which has no FIPS code
+    states = pd.DataFrame({'State': ['00'] + list(FIPS.keys()), 'State_Name': ['National'] + list(FIPS.values())})
+    pd.concat([states, columns(len(states))], axis=1).to_csv(
+        os.path.join(root, 'src/factsheets/MSD_State_Lvl_02.03.21.csv'), index=False)
+
+    keys = list(cds) + water
+    districts = pd.DataFrame({
+        'CONG_DIST': keys,
+        'State_Name': [FIPS[cd[:2]] for cd in keys],
+    })
+    pd.concat([districts, columns(len(keys))], axis=1).to_csv(
+        os.path.join(root, 'src/factsheets/MSD_CD_Lvl_02.03.21.csv'), index=False)
+
+    # Older state level data, for process_numberline.py
+    n = len(FIPS)
+    cols = {'State': list(FIPS.keys())}
+    for base in ['AVG_BAL_19', 'AVG_BAL_pch_0919', 'MED_BAL_19', 'MED_BAL_pch_0919', 'MED_INC_19']:
+        for demo in ['', '_ASIAN', '_BLACK', '_HISPANIC', '_MINORITY', '_WHITE']:
+            cols['{}{}'.format(base, demo)] = values(rng, n, 100)
+            cols['{}{}_Label'.format(base, demo)] = ['${:,.0f}'.format(v) for v in rng.random(n)*50000]
+            cols['{}{}_NatRank'.format(base, demo)] = rng.integers(1, n+1, n)
+    pd.DataFrame(cols).to_csv(
+        os.path.join(root, 'src/factsheets/MSD_State_Lvl_12.14.2020.csv'), index=False)
+
+def genStates(root, rng):
+    """State level SCI and enrollment, for process_states.py"""
+    # FIPS codes stand in for the state abbreviations
+    pd.DataFrame({
+        'STABBR': list(FIPS.keys()),
+        'medianSCI_allschools': values(rng, len(FIPS), 100, missing=0),
+        'total_enrollment_seats': rng.integers(1000, 1000000, len(FIPS)),
+    }).to_csv(os.path.join(root, 'src/2016.45min.StateLevelData.csv'), index=False)
+
+def genSummaryStats(root, rng):
+    types = ['All Schools', 'Public', 'Private Not For Profit', 'Private For Profit',
+             'Bachelors', 'Associates', 'Below Associates']
+    stats = ['Mean', 'Median']
+    groups = ['group1', 'group2', 'group3', 'group4', 'Ed_Desert',
+              'Median School Concentration', 'Average School Concentration']
+    for i in ISOCHRONES:
+        rows = [{'YEAR': int(y), 'School_Type': t, 'Statistic': s, 'STATE': st}
+                for y in YEARS for t in types for s in stats for st in FIPS.values()]
+        df = pd.DataFrame(rows)
+        for g in groups:
+            df[g] = values(rng, len(df), 100, missing=0)
+        df.to_csv(os.path.join(root, 'src/summary_stats/state/{}.csv'.format(i)), index=False)
+
+        df = df.drop_duplicates(['YEAR', 'School_Type', 'Statistic']).drop(columns=['STATE'])
+        df.to_csv(os.path.join(root, 'src/summary_stats/national/{}.csv'.format(i)), index=False)
+
+    schools = pd.DataFrame({'School Type': ['All Schools', 'Public', 'Private Not-for-profit',
+        'Private For-profit', 'Four-Year', 'Two-Year', 'Below Two-Year']})
+    for col in ['Count', 'Enrollment', 'Average Net Price']:
+        schools[col] = values(rng, len(schools), 10000, missing=0)
+    schools.to_csv(os.path.join(root, 'src/summary_stats/sumstats_schools.csv'), index=False)
+    zips = pd.DataFrame({'Statistic': stats})
+    for col in ['SCI', 'Population']:
+        zips[col] = values(rng, len(zips), 10000, missing=0)
+    zips.to_csv(os.path.join(root, 'src/summary_stats/sumstats_zips.csv'), index=False)
+
+def genRegions(root):
+    writeShapes(os.path.join(root, 'src/countries/ne_10m_admin_0_countries.shp'),
+        {'geometry': 'MultiPolygon', 'properties': {'ISO_A2': 'str', 'NAME': 'str'}}, [
+        {'geometry': mapping(MultiPolygon([box(-125, 24, -66, 50), box(-70, 20, -69, 21)])),
+         'properties': {'ISO_A2': 'US', 'NAME': 'United States'}},
+        {'geometry': mapping(MultiPolygon([box(-67, 17, -65, 19)])),
+         'properties': {'ISO_A2': 'PR', 'NAME': 'Puerto Rico'}},
+        {'geometry': mapping(MultiPolygon([box(0, 0, 1, 1)])),
+         'properties': {'ISO_A2': 'FR', 'NAME': 'France'}},
+    ])
+    for state, b in [('alaska', box(-170, 52, -130, 71)), ('hawaii', box(-160, 18, -154, 22))]:
+        with open(os.path.join(root, 'src/states/{}.geojson'.format(state)), 'w') as f:
+            json.dump({'type': 'Feature', 'properties': {}, 'geometry': mapping(b)}, f)
+
+
+def generate(root, loas, schools=None, cds=436, seed=0):
+    """Write a synthetic `src/` (and the `gen/` files
+    the scripts expect to already exist) under `root`"""
+    rng = np.random.default_rng(seed)
+    makeDirs(root, 'src/zips', 'src/school_zones', 'src/zctas', 'src/countries', 'src/lakes',
+             'src/states', 'src/factsheets', 'src/summary_stats/state', 'src/summary_stats/national',
+             'src/congressional_districts/zones', 'src/congressional_districts/shapes',
+             'gen/summary', 'gen/tile_data')
+
+    zctas, geoms, side = genZCTAs(root, rng, loas)
+    school_df, home = genSchools(root, rng, zctas, geoms, schools or max(10, loas//4))
+    zcta_zone_rows = genZones(root, rng, school_df, home, zctas, side)
+    cd_keys, water, cd_zone_rows = genCDs(root, rng, school_df, cds)
+    genFactsheets(root, rng, cd_keys, water)
+    genSummaryStats(root, rng)
+    genStates(root, rng)
+    genRegions(root)
+
+    # No corrections to start with; check_coords.py regenerates these
+    with open(os.path.join(root, 'gen/coordinate_corrections.json'), 'w') as f:
+        json.dump({}, f)
+
+    # For check_coords.py and reverse_geocode.py; no requests are made since
+    # every school is inside its ZIP's ZCTA and reverse geocoding is offline
+    with open(os.path.join(root, 'config.py'), 'w') as f:
+        f.write("GOOGLE_API_KEY = ''\nGOOGLE_PLACES_API_KEY = ''\n"
+                "GEOCODER = 'offline'\nGAZETTEER_ADDRESSES = 'src/addresses.csv'\n")
+
+    with open(os.path.join(root, 'synth.json'), 'w') as f:
+        json.dump({
+            'loas': loas,
+            'schools': len(home),
+            'cds': len(cd_keys),
+            'states': len(FIPS),
+            'years': len(YEARS),
+            'isochrones': len(ISOCHRONES),
+            'school_rows': len(school_df),
+            'zone_rows': {'ZCTA': zcta_zone_rows, 'CD': cd_zone_rows},
+            'seed': seed,
+        }, f, indent=2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', help='Directory to write the synthetic src/ and gen/ to')
+    parser.add_argument('--loas', type=int, default=1000, help='Number of ZCTAs (up to 100000)')
+    parser.add_argument('--schools', type=int, default=None, help='Number of schools (default: a quarter of --loas)')
+    parser.add_argument('--cds', type=int, default=436, help='Number of congressional districts')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.loas > 100000:
+        parser.error('ZCTAs are 5 digits, so --loas can be at most 100000')
+    generate(args.root, args.loas, args.schools, args.cds, args.seed)
@@ -0,0 +1,69 @@
+"""Cached ftfy text repair.
+
+School names and addresses in the source CSVs have encoding issues
+(double encoded utf8, I believe) which ftfy fixes, but it's slow and the
+same strings repeat a lot, within and across scripts and builds. Fixed
+strings are kept in memory and on disk (keyed by the raw string), and the
+cache is dropped whenever the ftfy version changes.
+"""
+
+import os
+import json
+import ftfy
+
+CACHE_PATH = 'gen/ftfy_cache.json'
+
+
+class TextFixer:
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self.cache = self._load()
+        self.loaded = len(self.cache)
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        if self.path is None:
+            return {}
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except FileNotFoundError:
+            return {}
+        if cached.get('version') != ftfy.__version__:
+            return {}
+        return cached['fixed']
+
+    def fix(self, text):
+        try:
+            fixed = self.cache[text]
+            self.hits += 1
+        except KeyError:
+            fixed = ftfy.fix_text(text)
+            self.cache[text] = fixed
+            self.misses += 1
+        return fixed
+
+    def save(self):
+        """Write the cache out, if anything was added"""
+        if self.path is None or len(self.cache) == self.loaded:
+            return
+        dir = os.path.dirname(self.path)
+        if dir and not os.path.exists(dir):
+            os.makedirs(dir)
+        with open(self.path, 'w') as f:
+            json.dump({'version': ftfy.__version__, 'fixed': self.cache}, f)
+        self.loaded = len(self.cache)
+
+    def report(self):
+        calls = self.hits + self.misses
+        changed = sum(1 for raw, fixed in self.cache.items() if raw != fixed)
+        return 'ftfy: {} calls, {} cache hits ({:.1%}), {} newly fixed; {}/{} cached strings needed repair'.format(
+            calls, self.hits, self.hits/calls if calls else 0, self.misses, changed, len(self.cache))
+
+
+# Shared by the scripts in this directory
+fixer = TextFixer()
+
+def fixText(text):
+    return fixer.fix(text)
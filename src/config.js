@@ -239,6 +239,7 @@ export default {
     SHORT_NAME: 'zip',
     MIN_PLACE_LENGTH: 5,
     NO_TERRITORIES: false,
+    PACKED: META['zcta'].packed,
     PROPS: PROPS_FOR_LOA['zcta'],
     INITIAL_STATE: {
       cat: INITIAL_CAT,
@@ -256,6 +257,7 @@ export default {
     SHORT_NAME: 'district',
     MIN_PLACE_LENGTH: 4,
     NO_TERRITORIES: true,
+    PACKED: META['cd'].packed,
     PROPS: PROPS_FOR_LOA['cd'],
     INITIAL_STATE: {
       cat: INITIAL_CAT,
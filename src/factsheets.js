@@ -101,7 +101,49 @@ function renderCollapsibleSection(id, title, parent) {
   return section;
 }
 
+// With `process_factsheets.py --shard`, the bundled dataset only
+// has the national factsheet; the rest are fetched from the shard
+// file the index points to, once per shard
+const factsheetShards = {};
+let factsheetIndex = null;
+function getJSON(url) {
+  return fetch(url, {
+      headers: {
+        'Accept': 'application/json',
+        'Content-Type': 'application/json'
+      },
+      method: 'GET',
+    })
+    .then(res => res.ok ? res.json() : {})
+    .catch(err => { console.log(err); return {}; });
+}
+
+function getFactsheet(name) {
+  if (name in dataset) return Promise.resolve(dataset[name]);
+  if (!factsheetIndex) {
+    factsheetIndex = getJSON('../assets/factsheets/index.json');
+  }
+  return factsheetIndex.then((index) => {
+    let file = index[name];
+    if (!file) return null;
+    if (!(file in factsheetShards)) {
+      factsheetShards[file] = getJSON(`../assets/factsheets/${file}`);
+    }
+    return factsheetShards[file].then((sheets) => sheets[name] || null);
+  });
+}
+
 function renderTables(tableState) {
+  let name = tableState.state;
+  getFactsheet(name).then((data) => {
+    // Skip if another region was selected in the meantime
+    if (data && tableState.state == name) {
+      renderFactsheet(tableState, data);
+    }
+  });
+}
+
+function renderFactsheet(tableState, data) {
   let infoEl = document.getElementById(`${tableState.mapId}--info`);
   if (tableState.state == 'National') {
     infoEl.classList.add('info-national');
@@ -145,7 +187,6 @@ function renderTables(tableState) {
     crossFootnote = '<sup>✝</sup>1st place = highest value. In-State Rank indicates how the selected congressional district ranks against other congressional districts in the same state, thus varies from 1 to the total number of districts in the state.';
   }
 
-  let data = dataset[tableState.state];
   let debtData = data['debt'][tableState.groups.debt];
   let medianDebtData = data['debt']['median']; // some data only has median now
   let instData = data['institutions'][tableState.groups.institutions];
@@ -1,3 +1,5 @@
+import util from './util';
+
 // DB-like interface
 class SchoolDB {
   constructor(config) {
@@ -32,11 +34,21 @@ class SchoolDB {
   }
 
   _getSchool(id) {
+    let packed = this.config.PACKED;
+    if (packed) {
+      let shard = Math.floor(id / packed.schools);
+      return util.getPacked(`${this.prefix}/assets/schools`, shard, id);
+    }
     let url = `${this.prefix}/assets/schools/${id}.json`;
     return this._get(url);
   }
 
   _getDataForKeyPlace(key, place) {
+    let packed = this.config.PACKED;
+    if (packed) {
+      let shard = place.slice(0, packed.prefix);
+      return util.getPacked(`${this.prefix}/assets/maps/${this.config.LOA}/by_cat/${key}`, shard, place);
+    }
     let url = `${this.prefix}/assets/maps/${this.config.LOA}/by_cat/${key}/${place}.json`;
     return this._get(url);
   }
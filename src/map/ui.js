@@ -35,7 +35,7 @@ function setupUI(map, config, legend, info, state) {
     placeInput.addEventListener('input', (ev) => {
       let place = ev.target.value;
       if (place.length == config.MIN_PLACE_LENGTH) {
-        util.bboxForPlace(loa, place).then((bbox) => {
+        util.bboxForPlace(loa, place, config.PACKED).then((bbox) => {
           if (!bbox) return;
           map.fitBounds(bbox);
           map.featsByProp({
@@ -23,7 +23,10 @@ function keyForCat(cat) {
     .join('.');
 }
 
-function bboxForPlace(loa, place) {
+function bboxForPlace(loa, place, packed) {
+  if (packed) {
+    return getPacked(`assets/maps/${loa}/bboxes`, place.slice(0, packed.prefix), place);
+  }
   let url = `assets/maps/${loa}/bboxes/${place}.json`;
   return fetch(url, {
     headers: {
@@ -36,4 +39,42 @@ function bboxForPlace(loa, place) {
     .catch(err => { console.log(err) });
 }
 
-export default {propForCat, keyForCat, bboxForPlace};
+// Packed records are grouped into shards,
+// each a pack of concatenated JSON records
+// and an index of each record's [offset, length].
+// Fetch the shard's index once, then just the
+// record's range of the pack.
+const packIndices = {};
+function getPacked(dir, shard, key) {
+  let indexUrl = `${dir}/${shard}.index.json`;
+  if (!(indexUrl in packIndices)) {
+    packIndices[indexUrl] = fetch(indexUrl, {
+        headers: {
+          'Accept': 'application/json',
+          'Content-Type': 'application/json'
+        },
+        method: 'GET',
+      })
+      .then(res => res.ok ? res.json() : {})
+      .catch(err => { console.log(err); return {}; });
+  }
+  return packIndices[indexUrl].then((index) => {
+    if (!(key in index)) return null;
+    let [offset, length] = index[key];
+    return fetch(`${dir}/${shard}.pack`, {
+        headers: {
+          'Range': `bytes=${offset}-${offset + length - 1}`
+        },
+        method: 'GET',
+      })
+      .then(res => res.text().then((text) => {
+        // Servers that don't support range requests
+        // send back the whole pack
+        if (res.status != 206) text = text.substr(offset, length);
+        return JSON.parse(text);
+      }))
+      .catch(err => { console.log(err) });
+  });
+}
+
+export default {propForCat, keyForCat, bboxForPlace, getPacked};